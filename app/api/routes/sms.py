@@ -1,26 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import select, union, any_, bindparam, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PGUUID
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Dict, Any, Optional
+from sqlalchemy.exc import SQLAlchemyError
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
+from datetime import datetime
+import base64
+import hashlib
+import logging
 
 from app.database import get_db
 from app.config import get_settings, Settings
-from app.utils.logger import setup_logger
 from app.models.student import Student
 from app.schemas.sms import BulkSMSRequest, FeeNotificationRequest, SMSFilter
 from app.services.sms_service import SMSService
 from app.services.phone_validator import PhoneValidatorService
 
 router = APIRouter()
-logger = setup_logger()
+logger = logging.getLogger("school_management")
+
+# Binding the IDs as one uuid[] parameter keeps the SQL text identical for any
+# number of IDs, so asyncpg reuses a single prepared statement.
+_FEE_NOTIFICATION_STUDENTS_QUERY = (
+    select(
+        Student.id,
+        Student.name,
+        Student.fee_status,
+        Student.parent1_phone,
+        Student.parent2_phone
+    )
+    .where(Student.id == any_(bindparam("student_ids", type_=ARRAY(PGUUID(as_uuid=True)))))
+    .execution_options(yield_per=500)
+)
 
 def get_sms_service(
+    request: Request,
     settings: Settings = Depends(get_settings),
     db: AsyncSession = Depends(get_db)
 ) -> SMSService:
-    return SMSService(settings, db)
+    # Reuse the app-wide WinSMS client so connections are pooled across requests
+    return SMSService(
+        settings, db,
+        client=request.app.state.http_client,
+        log_writer=request.app.state.sms_log_writer
+    )
 
 @router.post("/fee-notification", response_model=Dict[str, Any], status_code=status.HTTP_200_OK)
 async def send_fee_notification_sms(
@@ -37,82 +62,65 @@ async def send_fee_notification_sms(
             detail="No student IDs provided for fee notification."
         )
 
-    result = await db.execute(select(Student).filter(Student.id.in_(request.student_ids)))
-    students = result.scalars().all()
-    if not students:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No students found for the provided IDs."
-        )
+    # Stream only the columns needed for the message, as lightweight rows in chunks
+    result = await db.stream(_FEE_NOTIFICATION_STUDENTS_QUERY, {"student_ids": request.student_ids})
 
     results = []
-    try:
-        for student in students:
-            try:
-                # Prepare template variables, overriding with any provided in the request
-                template_vars = {
-                    "student_name": student.name,
-                    "fee_status": student.fee_status,
-                    **(request.template_vars or {})
-                }
-                message = sms_service.render_message_template(
-                    template_name="fee_notification",
-                    **template_vars
-                )
-            except ValueError as e:
-                logger.error(f"Failed to render message template for student {student.id}: {e}")
-                results.append({
-                    "student_id": str(student.id),
-                    "status": "failed",
-                    "detail": f"Template rendering error: {e}"
-                })
-                continue
-
-            # Send to parent1_phone
-            result1 = await sms_service.send_sms(
-                to=student.parent1_phone,
-                message=message,
-                student_id=str(student.id)
+    payload = []
+    meta = []
+    students_found = False
+    async for student in result:
+        students_found = True
+        try:
+            # Prepare template variables, overriding with any provided in the request
+            template_vars = {
+                "student_name": student.name,
+                "fee_status": student.fee_status,
+                **(request.template_vars or {})
+            }
+            message = sms_service.render_message_template(
+                template_name="fee_notification",
+                **template_vars
             )
+        except ValueError as e:
+            logger.error(f"Failed to render message template for student {student.id}: {e}")
             results.append({
                 "student_id": str(student.id),
-                "parent1_phone": student.parent1_phone,
-                "status": result1["status"],
-                "detail": result1.get("detail"),
-                "message_id": result1.get("message_id")
+                "status": "failed",
+                "detail": f"Template rendering error: {e}"
             })
+            continue
 
-            # Send to parent2_phone if available
-            if student.parent2_phone:
-                result2 = await sms_service.send_sms(
-                    to=student.parent2_phone,
-                    message=message,
-                    student_id=str(student.id)
-                )
-                results.append({
-                    "student_id": str(student.id),
-                    "parent2_phone": student.parent2_phone,
-                    "status": result2["status"],
-                    "detail": result2.get("detail"),
-                    "message_id": result2.get("message_id")
-                })
-        
-        await db.commit()
+        # Queue a send to parent1_phone, and to parent2_phone if available
+        recipients = [("parent1_phone", student.parent1_phone)]
+        if student.parent2_phone:
+            recipients.append(("parent2_phone", student.parent2_phone))
 
-        successful_sends = sum(1 for r in results if r.get("status") == "success")
-        if successful_sends == 0 and students: # Only raise if there were students but no successful sends
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to send any SMS notifications."
-            )
-        elif not students: # If no students were found, the initial check should have caught it, but as a safeguard
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="No students found for the provided IDs."
-            )
+        for phone_field, phone in recipients:
+            payload.append({"to": phone, "message": message, "student_id": str(student.id)})
+            meta.append((str(student.id), phone_field, phone))
+
+    if not students_found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No students found for the provided IDs."
+        )
+
+    # send_bulk_personalized handles its own provider errors and reports them per recipient
+    send_results = await sms_service.send_bulk_personalized(payload) if payload else []
+    for (student_id, phone_field, phone), send_result in zip(meta, send_results):
+        results.append({
+            "student_id": student_id,
+            phone_field: phone,
+            "status": send_result["status"],
+            "detail": send_result.get("detail"),
+            "message_id": send_result.get("message_id")
+        })
 
-        return {"message": "Fee notification SMS sending initiated.", "results": results}
-    except Exception as e:
+    try:
+        # Persist the SMS log rows recorded while sending
+        await db.commit()
+    except SQLAlchemyError as e:
         logger.error(f"Transaction failed for fee notification SMS: {e}")
         await db.rollback()
         raise HTTPException(
@@ -120,6 +128,15 @@ async def send_fee_notification_sms(
             detail=f"An unexpected error occurred during SMS notification: {e}"
         )
 
+    successful_sends = sum(1 for r in results if r.get("status") == "success")
+    if successful_sends == 0: # Only reached when students were found, so no sends succeeded
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to send any SMS notifications."
+        )
+
+    return {"message": "Fee notification SMS sending initiated.", "results": results}
+
 from app.models.sms_log import SMSLog
 from app.schemas.sms_log import SMSLogResponse
 
@@ -132,37 +149,36 @@ async def send_bulk_sms_to_filtered_groups(
     """
     Sends bulk SMS messages to filtered groups of students' parents.
     """
-    query = select(Student)
+    conditions = []
 
     if request.filters:
         if request.filters.grades:
-            query = query.where(Student.grade.in_(request.filters.grades))
+            conditions.append(Student.grade.in_(request.filters.grades))
         if request.filters.class_letters:
             # Ensure class letters are uppercase for consistency with database
             upper_class_letters = [cl.upper() for cl in request.filters.class_letters]
-            query = query.where(Student.class_letter.in_(upper_class_letters))
+            conditions.append(Student.class_letter.in_(upper_class_letters))
         if request.filters.fee_status:
-            query = query.where(Student.fee_status == request.filters.fee_status)
-
-    result = await db.execute(query)
-    students = result.scalars().all()
+            conditions.append(Student.fee_status == request.filters.fee_status)
 
-    if not students:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No students found matching the provided filters."
+    # Let Postgres return the distinct recipient phones directly
+    query = select(Student.parent1_phone.label("phone")).where(*conditions)
+    if request.use_primary_contact:
+        query = query.distinct()
+    else:
+        query = union(
+            query,
+            select(Student.parent2_phone.label("phone")).where(*conditions, Student.parent2_phone.isnot(None))
         )
 
-    recipients = set()
-    for student in students:
-        recipients.add(student.parent1_phone)
-        if not request.use_primary_contact and student.parent2_phone:
-            recipients.add(student.parent2_phone)
+    result = await db.execute(query)
+    recipients = result.scalars().all()
 
+    # parent1_phone is required, so no recipients means no students matched
     if not recipients:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="No valid recipients found for the filtered students."
+            detail="No students found matching the provided filters."
         )
 
     bulk_results = await sms_service.send_bulk_sms(
@@ -170,6 +186,17 @@ async def send_bulk_sms_to_filtered_groups(
         message=request.message,
     )
 
+    try:
+        # Persist the SMS log rows written while sending
+        await db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Transaction failed for bulk SMS: {e}")
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred during bulk SMS: {e}"
+        )
+
     successful_sends = sum(1 for r in bulk_results if r.get("status") == "success")
     if successful_sends == 0:
         raise HTTPException(
@@ -179,38 +206,92 @@ async def send_bulk_sms_to_filtered_groups(
 
     return {"message": "Bulk SMS sending initiated.", "results": bulk_results}
 
+def _encode_history_cursor(sms_log: SMSLog) -> str:
+    """
+    Encodes the position of an SMS log in history order as an opaque cursor.
+    """
+    position = f"{sms_log.sent_at.isoformat()}|{sms_log.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def _decode_history_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Decodes a history cursor back into its (sent_at, id) position.
+    """
+    try:
+        sent_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(sent_at), UUID(log_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid history cursor."
+        )
+
 @router.get("/history", response_model=List[SMSLogResponse], status_code=status.HTTP_200_OK)
 async def get_sms_history(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     student_id: Optional[UUID] = None,
     status: Optional[str] = None,
     template_name: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 10
+    after: Optional[str] = None,
+    skip: int = Query(0, ge=0, le=100_000),
+    limit: int = Query(10, ge=1, le=500)
 ):
     """
     Retrieves SMS history logs.
 
-    This endpoint retrieves the history of SMS messages sent. It supports filtering by student ID, status, and template name. Pagination is supported via the skip and limit parameters.
+    This endpoint retrieves the history of SMS messages sent. It supports filtering by student ID, status, and template name. Pagination is supported via the skip and limit parameters, or via the after cursor.
+    When a full page is returned, the X-Next-Cursor response header holds the cursor for the next page.
+    Responses carry an ETag; repeat requests sending it in If-None-Match get a 304 while the page is unchanged.
 
     - **student_id**: Optional UUID to filter logs by student ID.
     - **status**: Optional string to filter logs by status (e.g., 'success', 'failed').
     - **template_name**: Optional string to filter logs by template name.
-    - **skip**: Integer for pagination, number of logs to skip.
-    - **limit**: Integer for pagination, maximum number of logs to return.
+    - **after**: Optional opaque cursor from a previous X-Next-Cursor header; when given, skip is ignored.
+    - **skip**: Integer for pagination, number of logs to skip (max 100000).
+    - **limit**: Integer for pagination, maximum number of logs to return (1-500).
 
     - **returns**: List of SMSLogResponse objects representing the SMS history logs.
     """
-    query = select(SMSLog)
+    conditions = []
 
     if student_id:
-        query = query.where(SMSLog.student_id == student_id)
+        conditions.append(SMSLog.student_id == student_id)
     if status:
-        query = query.where(SMSLog.status == status)
+        conditions.append(SMSLog.status == status)
     if template_name:
-        query = query.where(SMSLog.template_name == template_name)
+        conditions.append(SMSLog.template_name == template_name)
+
+    # Newest first; id breaks ties so pages are stable
+    query = (
+        select(SMSLog)
+        .where(*conditions)
+        .order_by(SMSLog.sent_at.desc(), SMSLog.id.desc())
+    )
+    if after:
+        # Keyset pagination: seek past the last row seen instead of scanning skipped rows
+        after_sent_at, after_id = _decode_history_cursor(after)
+        query = query.where(tuple_(SMSLog.sent_at, SMSLog.id) < tuple_(after_sent_at, after_id))
+    else:
+        query = query.offset(skip)
 
-    result = await db.execute(query.offset(skip).limit(limit))
+    result = await db.execute(query.limit(limit))
     sms_logs = result.scalars().all()
 
+    # The ETag is taken from the page itself, so revalidating costs only the page query.
+    # Logs are only ever inserted, or unlinked (student_id set to NULL) when their student
+    # is deleted, so the (id, student_id) pairs change whenever the page does.
+    page_hash = hashlib.blake2b(digest_size=16)
+    for sms_log in sms_logs:
+        page_hash.update(f"{sms_log.id}|{sms_log.student_id}\n".encode())
+    etag = f'W/"{page_hash.hexdigest()}"'
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    if len(sms_logs) == limit:
+        response.headers["X-Next-Cursor"] = _encode_history_cursor(sms_logs[-1])
     return sms_logs
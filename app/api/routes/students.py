@@ -1,20 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Response
+from sqlalchemy import func, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from uuid import UUID
-import re
 import csv
-from io import StringIO
+import logging
+from io import StringIO, TextIOWrapper
 
 from app.models.student import Student
-from app.schemas.student import StudentCreate, StudentUpdate, StudentInDB
+from app.models.sms_log import SMSLog
+from app.schemas.student import StudentCreate, StudentUpdate, StudentInDB, GRADES, VALID_GRADES, FEE_STATUSES, CLASS_LETTERS
 from app.database import get_db
 from app.services.phone_validator import PhoneValidatorService
 from app.services.student_importer import StudentImporterService # Import the new service
-from app.utils.logger import setup_logger
 
 def _validate_class_letter(class_letter: str):
     """
@@ -26,28 +26,37 @@ def _validate_class_letter(class_letter: str):
             detail="class_letter is required and must be a string"
         )
     
-    if not re.match(r'^[A-Z]$', class_letter.upper()):
+    upper_letter = class_letter.upper()
+    if upper_letter not in CLASS_LETTERS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="class_letter must be a single letter from A to Z"
         )
     
-    return class_letter.upper()
+    return upper_letter
 
 def _validate_grade(grade: str):
     """
     Validates if the grade is one of the valid school grades.
     """
-    valid_grades = ['Grade R', 'Grade 1', 'Grade 2', 'Grade 3', 'Grade 4', 'Grade 5', 'Grade 6', 'Grade 7']
-    
-    if grade not in valid_grades:
+    if grade not in VALID_GRADES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid grade: {grade}. Must be one of {valid_grades}"
+            detail=f"Invalid grade: {grade}. Must be one of {list(GRADES)}"
         )
 
 router = APIRouter()
-logger = setup_logger()
+logger = logging.getLogger("school_management")
+
+# Columns of StudentInDB, selected as-is for the list endpoint
+STUDENT_LIST_COLUMNS = (
+    Student.id, Student.name, Student.grade, Student.class_letter,
+    Student.parent1_phone, Student.parent2_phone, Student.fee_status,
+    Student.created_at, Student.updated_at,
+)
+
+# Grades are derived from student data, so cache for minutes rather than days
+GRADES_CACHE_CONTROL = "public, max-age=300"
 
 @router.post("/import-csv", response_model=Dict[str, Any], status_code=status.HTTP_200_OK)
 async def import_students_csv(
@@ -74,12 +83,12 @@ async def import_students_csv(
         )
 
     try:
-        # Read the CSV file content
-        csv_content = await file.read()
-        csv_content_str = csv_content.decode('utf-8')
-
-        # Pass content to the importer service
-        import_summary = await StudentImporterService.import_students_from_csv(db, csv_content_str)
+        # Decode the spooled upload line by line rather than reading it into memory whole
+        csv_lines = TextIOWrapper(file.file, encoding='utf-8', newline='')
+        try:
+            import_summary = await StudentImporterService.import_students_from_csv(db, csv_lines)
+        finally:
+            csv_lines.detach() # Leave closing the underlying file to UploadFile
         
         if import_summary["failed_imports"]:
             status_code = status.HTTP_207_MULTI_STATUS # Some records failed
@@ -139,7 +148,6 @@ async def create_student(student: StudentCreate, db: AsyncSession = Depends(get_
         db_student = Student(**student.dict())
         db.add(db_student)
         await db.commit()
-        await db.refresh(db_student)
 
         logger.info(f"Created student: {db_student.id}, Grade: {db_student.grade}, Class: {db_student.class_letter}")
         return db_student
@@ -153,15 +161,19 @@ async def create_student(student: StudentCreate, db: AsyncSession = Depends(get_
 
 @router.get("/", response_model=List[StudentInDB])
 async def read_students(
+    response: Response,
     grade: Optional[str] = Query(None, description="Filter by grade, e.g., 'Grade 1'"),
     class_letter: Optional[str] = Query(None, description="Filter by class letter, e.g., 'A'"),
     fee_status: Optional[str] = Query(None, description="Filter by fee status ('paid' or 'unpaid')"),
     sort_by: Optional[str] = Query(None, description="Sort by field (e.g., 'name', 'grade', 'class_letter')"),
     sort_order: Optional[str] = Query("asc", description="Sort order ('asc' or 'desc')"),
+    skip: int = Query(0, ge=0, description="Number of students to skip"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of students to return"),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get a list of students with optional grade, class, and fee status filtering.
+    Get a page of students with optional grade, class, and fee status filtering.
+    The X-Total-Count response header holds the number of students matching the filters.
 
     Args:
         grade: Optional grade filter
@@ -169,26 +181,34 @@ async def read_students(
         fee_status: Optional fee status filter
         sort_by: Optional field to sort by
         sort_order: Sort order (asc or desc)
+        skip: Number of students to skip
+        limit: Maximum number of students to return (1-1000)
         db: Database session
 
     Returns:
         List of student records
     """
     try:
-        query = select(Student)
-        
         # Apply filters
+        conditions = []
         if grade:
-            query = query.where(Student.grade == grade)
+            conditions.append(Student.grade == grade)
         if class_letter:
-            query = query.where(Student.class_letter == class_letter.upper())
+            conditions.append(Student.class_letter == class_letter.upper())
         if fee_status:
-            if fee_status not in ["paid", "unpaid"]:
+            if fee_status not in FEE_STATUSES:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="fee_status must be either 'paid' or 'unpaid'"
                 )
-            query = query.where(Student.fee_status == fee_status)
+            conditions.append(Student.fee_status == fee_status)
+
+        # The list is paginated, so tell the client how many students match in total
+        total_count = await db.scalar(select(func.count(Student.id)).where(*conditions))
+        response.headers["X-Total-Count"] = str(total_count)
+
+        # Project the response columns directly; rows skip ORM identity tracking and hydration
+        query = select(*STUDENT_LIST_COLUMNS).where(*conditions)
 
         # Apply sorting
         if sort_by:
@@ -207,8 +227,11 @@ async def read_students(
             # Default sort order: grade, then class, then name
             query = query.order_by(Student.grade.asc(), Student.class_letter.asc(), Student.name.asc())
 
+        # Tie-break on id so pages stay stable when the sort column has duplicates
+        query = query.order_by(Student.id.asc()).offset(skip).limit(limit)
+
         result = await db.execute(query)
-        students = result.scalars().all()
+        students = [dict(row) for row in result.mappings()]
 
         # Build log message
         log_parts = []
@@ -224,6 +247,7 @@ async def read_students(
             log_message += f" for {', '.join(log_parts)}"
         
         logger.info(log_message)
+        # Plain row dicts; FastAPI validates and serializes them through response_model
         return students
 
     except SQLAlchemyError as e:
@@ -245,47 +269,36 @@ async def get_statistics(db: AsyncSession = Depends(get_db)):
         Dictionary with statistics
     """
     try:
-        # Get total students
-        total_result = await db.execute(select(func.count(Student.id)))
-        total_students = total_result.scalar()
-
-        # Get fee status counts
-        paid_result = await db.execute(
-            select(func.count(Student.id)).where(Student.fee_status == "paid")
-        )
-        paid_students = paid_result.scalar()
-        unpaid_students = total_students - paid_students
-
-        # Get students by grade and class
+        # One grouped query; fee status counts come from filtered aggregates in the same scan
         grade_class_result = await db.execute(
-            select(Student.grade, Student.class_letter, func.count(Student.id))
-            .group_by(Student.grade, Student.class_letter)
-            .order_by(Student.grade, Student.class_letter)
-        )
-        students_by_grade_class = {}
-        for grade, class_letter, count in grade_class_result:
-            if grade not in students_by_grade_class:
-                students_by_grade_class[grade] = {}
-            students_by_grade_class[grade][class_letter] = count
-
-        # Get fee status by grade and class
-        grade_class_fee_result = await db.execute(
             select(
                 Student.grade,
                 Student.class_letter,
-                Student.fee_status,
-                func.count(Student.id)
+                func.count(Student.id),
+                func.count(Student.id).filter(Student.fee_status == "paid"),
+                func.count(Student.id).filter(Student.fee_status == "unpaid")
             )
-            .group_by(Student.grade, Student.class_letter, Student.fee_status)
-            .order_by(Student.grade, Student.class_letter, Student.fee_status)
+            .group_by(Student.grade, Student.class_letter)
+            .order_by(Student.grade, Student.class_letter)
         )
+        total_students = 0
+        paid_students = 0
+        unpaid_students = 0
+        students_by_grade_class = {}
         fee_status_by_grade_class = {}
-        for grade, class_letter, fee_status, count in grade_class_fee_result:
-            if grade not in fee_status_by_grade_class:
+        for grade, class_letter, count, paid_count, unpaid_count in grade_class_result:
+            total_students += count
+            paid_students += paid_count
+            unpaid_students += unpaid_count
+
+            if grade not in students_by_grade_class:
+                students_by_grade_class[grade] = {}
                 fee_status_by_grade_class[grade] = {}
-            if class_letter not in fee_status_by_grade_class[grade]:
-                fee_status_by_grade_class[grade][class_letter] = {"paid": 0, "unpaid": 0}
-            fee_status_by_grade_class[grade][class_letter][fee_status] = count
+            students_by_grade_class[grade][class_letter] = count
+            fee_status_by_grade_class[grade][class_letter] = {
+                "paid": paid_count,
+                "unpaid": unpaid_count
+            }
 
         stats = {
             "total_students": total_students,
@@ -306,11 +319,15 @@ async def get_statistics(db: AsyncSession = Depends(get_db)):
         )
 
 @router.get("/grades", response_model=List[str])
-async def get_grades(db: AsyncSession = Depends(get_db)):
+async def get_grades(response: Response, db: AsyncSession = Depends(get_db)):
     """
     Get the list of available grades dynamically from existing students.
 
+    The list only changes when students in a new grade are added, so clients
+    may cache it briefly.
+
     Args:
+        response: Outgoing response, used to set caching headers
         db: Database session
 
     Returns:
@@ -319,7 +336,8 @@ async def get_grades(db: AsyncSession = Depends(get_db)):
     try:
         result = await db.execute(select(Student.grade).distinct().order_by(Student.grade))
         grades = result.scalars().all()
-        logger.info(f"Fetched available grades: {grades}")
+        response.headers["Cache-Control"] = GRADES_CACHE_CONTROL
+        logger.debug(f"Fetched available grades: {grades}")
         return grades
     except SQLAlchemyError as e:
         logger.error(f"Database error fetching grades: {e}")
@@ -411,16 +429,6 @@ async def update_student(
         Updated student record
     """
     try:
-        result = await db.execute(select(Student).where(Student.id == student_id))
-        student = result.scalar_one_or_none()
-
-        if not student:
-            logger.warning(f"Student not found for update: {student_id}")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Student not found"
-            )
-
         # Validate phone numbers if provided
         if student_update.parent1_phone is not None:
             try:
@@ -450,12 +458,28 @@ async def update_student(
         if student_update.class_letter is not None:
             student_update.class_letter = _validate_class_letter(student_update.class_letter)
 
-        # Update student fields
-        for key, value in student_update.dict(exclude_unset=True).items():
-            setattr(student, key, value)
+        # Apply the changes and read the row back in one statement
+        update_values = student_update.dict(exclude_unset=True)
+        if update_values:
+            query = (
+                update(Student)
+                .where(Student.id == student_id)
+                .values(**update_values)
+                .returning(Student)
+            )
+        else:
+            query = select(Student).where(Student.id == student_id)
+        result = await db.execute(query)
+        student = result.scalar_one_or_none()
+
+        if not student:
+            logger.warning(f"Student not found for update: {student_id}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Student not found"
+            )
 
         await db.commit()
-        await db.refresh(student)
 
         logger.info(f"Updated student: {student_id}, Grade: {student.grade}, Class: {student.class_letter}")
         return student
@@ -477,20 +501,29 @@ async def delete_student(student_id: UUID, db: AsyncSession = Depends(get_db)):
         db: Database session
     """
     try:
-        result = await db.execute(select(Student).where(Student.id == student_id))
-        student = result.scalar_one_or_none()
+        # Detach SMS history first so the foreign key does not block the delete
+        await db.execute(
+            update(SMSLog)
+            .where(SMSLog.student_id == student_id)
+            .values(student_id=None)
+        )
+        result = await db.execute(
+            delete(Student)
+            .where(Student.id == student_id)
+            .returning(Student.grade, Student.class_letter)
+        )
+        deleted = result.one_or_none()
 
-        if not student:
+        if not deleted:
             logger.warning(f"Student not found for deletion: {student_id}")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Student not found"
             )
 
-        await db.delete(student)
         await db.commit()
 
-        logger.info(f"Deleted student: {student_id}, Grade: {student.grade}, Class: {student.class_letter}")
+        logger.info(f"Deleted student: {student_id}, Grade: {deleted.grade}, Class: {deleted.class_letter}")
 
     except SQLAlchemyError as e:
         logger.error(f"Database error deleting student {student_id}: {e}")
@@ -502,7 +535,7 @@ async def delete_student(student_id: UUID, db: AsyncSession = Depends(get_db)):
 @router.patch("/{student_id}/fee-status", response_model=StudentInDB)
 async def update_fee_status(
     student_id: UUID,
-    fee_status: str = Query(..., description="New fee status ('paid' or 'unpaid')"),
+    fee_status: Literal["paid", "unpaid"] = Query(..., description="New fee status ('paid' or 'unpaid')"),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -517,7 +550,14 @@ async def update_fee_status(
         Updated student record
     """
     try:
-        result = await db.execute(select(Student).where(Student.id == student_id))
+        # fee_status is already constrained by its Literal type, so bad values are
+        # rejected with a 422 before the handler runs
+        result = await db.execute(
+            update(Student)
+            .where(Student.id == student_id)
+            .values(fee_status=fee_status)
+            .returning(Student)
+        )
         student = result.scalar_one_or_none()
 
         if not student:
@@ -527,15 +567,7 @@ async def update_fee_status(
                 detail="Student not found"
             )
 
-        if fee_status not in ["paid", "unpaid"]:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="fee_status must be either 'paid' or 'unpaid'"
-            )
-
-        student.fee_status = fee_status
         await db.commit()
-        await db.refresh(student)
 
         logger.info(f"Updated fee status for student {student_id}: {fee_status}")
         return student
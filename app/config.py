@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -6,12 +7,18 @@ class Settings(BaseSettings):
     db_password: str
     db_name: str
     database_url: str
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30  # Seconds to wait for a free connection
+    db_pool_recycle: int = 1800  # Seconds before a connection is replaced
     debug: bool = False
     log_level: str = "INFO"
 
     # WinSMS Configuration
     winsms_api_key: str
     winsms_api_url: str = "https://www.winsms.co.za/api/rest/v1"  # Correct default URL
+    sms_concurrency: int = 20  # Max in-flight WinSMS requests per notification run
+    sms_batch_size: int = 500  # Max recipients per WinSMS send request
 
     # Docker Development
     compose_project_name: str
@@ -19,5 +26,7 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
+@lru_cache
 def get_settings():
+    # Parsed once; every caller, including the per-request Depends(get_settings), shares it
     return Settings()
\ No newline at end of file
@@ -1,10 +1,21 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 from app.config import get_settings
 from typing import AsyncGenerator
 
-engine = create_async_engine(get_settings().database_url, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+settings = get_settings()
+
+engine = create_async_engine(
+    settings.database_url,
+    echo=settings.debug,  # SQL statement logging is for local debugging only
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,  # Drop connections that died while idle
+)
+# Keep attributes loaded after commit, so responses never trigger a lazy reload
+SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
 Base = declarative_base()
 
 async def init_db():
@@ -1,51 +1,71 @@
 from fastapi import FastAPI, Request
 from app.config import get_settings
-from app.database import init_db
+from app.database import init_db, SessionLocal
 from app.api.routes import students, sms
 from app.utils.logger import setup_logger
+from app.services.sms_service import create_sms_client, warm_up_sms_client
+from app.services.sms_log_writer import SMSLogWriter
 from contextlib import asynccontextmanager
+import logging
 import time
 from starlette.middleware.cors import CORSMiddleware
 
 settings = get_settings()
 
-logger = setup_logger(settings.log_level)
+# Configured once, by setup_logger in the lifespan
+logger = logging.getLogger("school_management")
 
 origins = [
     "http://localhost:5173",  # Your frontend's origin for development
     "https://bee.juniorflamebet.workers.dev",  # Your React app on Cloudflare Workers
     "https://api-proxy.juniorflamebet.workers.dev",  # Your proxy worker
-    "https://*.juniorflamebet.workers.dev",  # Any subdomain of your workers
     "https://internally-alive-bream.ngrok-free.app",
     "https://bee-669.pages.dev"
     # You can add other origins if needed
 ]
 
+# CORSMiddleware only matches allow_origins literally, so worker subdomains need a regex
+origin_regex = r"^https://([a-z0-9-]+\.)?juniorflamebet\.workers\.dev$"
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    setup_logger(settings.log_level)
+    logger.debug(f"Registered routes: {[route.path for route in app.routes if hasattr(route, 'path')]}")
     app.state.settings = settings
+    app.state.http_client = create_sms_client(settings)
+    await warm_up_sms_client(app.state.http_client)
     await init_db()
-    setup_logger(settings.log_level)
+    app.state.sms_log_writer = SMSLogWriter(SessionLocal)
+    app.state.sms_log_writer.start()
     yield
     # Shutdown
-    # Add any shutdown logic here if needed
+    await app.state.sms_log_writer.stop()
+    await app.state.http_client.aclose()
 
+# FastAPI serializes response_model results straight to JSON bytes through Pydantic's core,
+# which is faster than routing them through ORJSONResponse (deprecated in current FastAPI)
 app = FastAPI(lifespan=lifespan)
 
+# Requests slower than this are logged at INFO even when they succeed
+SLOW_REQUEST_SECONDS = 0.5
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.monotonic()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    logger.info(f"{request.method} {request.url.path} - {response.status_code} - {process_time:.4f}s")
+    process_time = time.monotonic() - start_time
+    # Only slow or failed requests are worth an INFO line; the rest go to DEBUG
+    if process_time > SLOW_REQUEST_SECONDS or response.status_code >= 400:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s - %d - %.4fs", request.method, request.url.path, response.status_code, process_time)
     return response
 
 app.include_router(students.router, prefix="/api/students", tags=["students"])
 app.include_router(sms.router, prefix="/api/sms", tags=["sms"])
-for route in app.routes:
-    if hasattr(route, 'path'):
-        print(f"Registered route: {route.path}")
 
 @app.get("/")
 async def read_root():
@@ -54,8 +74,10 @@ async def read_root():
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
+    allow_origin_regex=origin_regex,
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag", "X-Next-Cursor", "X-Total-Count"],  # Let the frontend read caching/pagination headers
 )
 
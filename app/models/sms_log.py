@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -19,4 +19,11 @@ class SMSLog(Base):
     is_bulk = Column(Boolean, default=False)
     template_name = Column(String(50), nullable=True)
 
-    student = relationship("Student", back_populates="sms_logs")
+    student = relationship("Student", back_populates="sms_logs", lazy="raise")
+
+    __table_args__ = (
+        Index('ix_sms_log_filter', 'student_id', 'template_name', 'status', sent_at.desc()),
+        # Matches the history order (sent_at DESC, id DESC), so unfiltered and status-only pages
+        # and keyset seeks read just limit rows from the index instead of sorting the table
+        Index('ix_sms_log_history_order', sent_at.desc(), id.desc()),
+    )
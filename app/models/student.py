@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, UniqueConstraint, func, CheckConstraint
+from sqlalchemy import Column, String, DateTime, UniqueConstraint, func, CheckConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from sqlalchemy.orm import relationship
@@ -19,11 +19,22 @@ class Student(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    sms_logs = relationship("SMSLog", back_populates="student") # Add this line
+    # Never lazy load in async code; use selectinload(Student.sms_logs) where logs are needed
+    sms_logs = relationship("SMSLog", back_populates="student", lazy="raise")
+
+    # Fetch server-generated columns (created_at, updated_at) with RETURNING on insert/update
+    __mapper_args__ = {"eager_defaults": True}
 
     __table_args__ = (
         CheckConstraint(grade.in_(['Grade R', 'Grade 1', 'Grade 2', 'Grade 3', 'Grade 4', 'Grade 5', 'Grade 6', 'Grade 7']), name='check_grade'),
         CheckConstraint(fee_status.in_(['paid', 'unpaid']), name='check_fee_status'),
         CheckConstraint(class_letter.regexp_match('^[A-Z]$'), name='check_class_letter'),
         UniqueConstraint('name', 'grade', 'class_letter', name='uq_student_name_grade_class'),
+        # Lets the bulk SMS filter (grade IN (...) AND fee_status = ...) seek on both columns
+        Index('ix_student_grade_fee_status', 'grade', 'fee_status'),
+        Index('ix_student_fee_status', 'fee_status'),
+        # Covers grade and grade/class filters, matches the default read_students ordering (including
+        # its id tie-break) so no sort is needed, and with fee_status included lets statistics
+        # aggregate from the index alone
+        Index('ix_student_default_order', 'grade', 'class_letter', 'name', 'id', postgresql_include=['fee_status']),
     )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 from datetime import datetime
 from uuid import UUID
@@ -17,8 +17,7 @@ class SMSLogCreate(SMSLogBase):
     pass
 
 class SMSLogResponse(SMSLogBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: UUID
     sent_at: datetime
-
-    class Config:
-        from_attributes = True
@@ -1,44 +1,93 @@
+import functools
 import re
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
+
+_NON_DIGIT_RE = re.compile(r'\D')
+# The accepted formats once spaces and dashes, the usual separators, are removed
+_PHONE_RE = re.compile(r'^(?:0(\d{9})|\+?27(\d{9}))$')
+_PHONE_PREFIXES = ('0', '27', '+27')
+# Deletes every ASCII non-digit in one C-level pass; the regex remains the fallback for other text
+_ASCII_NON_DIGITS = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+@functools.lru_cache(maxsize=4096)
+def _clean_and_validate_phone_impl(phone: str) -> str:
+    """
+    Cleans and validates a South African phone number according to specified rules.
+    Ensures it's in 27XXXXXXXXX format (11 characters).
+    Raises ValueError for invalid formats.
+    Results are memoized, since the same numbers are validated repeatedly.
+    """
+    # Fast paths for numbers that are already plain digits in a known format
+    if phone.isascii() and phone.isdigit():
+        if len(phone) == 11 and phone.startswith('27'):
+            return phone
+        if len(phone) == 10 and phone[0] == '0':
+            return '27' + phone[1:]
+
+    # Formatted numbers such as '+27 72 123 4567' or '072-123-4567' take one regex match.
+    # Anything else falls through to the checks below, which also produce the error messages.
+    if phone.startswith(_PHONE_PREFIXES):
+        match = _PHONE_RE.match(phone.replace(' ', '').replace('-', ''))
+        if match:
+            return '27' + (match.group(1) or match.group(2))
+
+    original_phone = phone
+    if phone.isascii():
+        digits_only = phone.translate(_ASCII_NON_DIGITS)
+    else:
+        digits_only = _NON_DIGIT_RE.sub('', phone)
+
+    if not digits_only:
+        raise ValueError("Phone number cannot be empty.")
+
+    formatted_phone = None
+
+    if original_phone.startswith('0'):
+        if len(digits_only) == 10 and digits_only.startswith('0'):
+            # Remove leading '0' and prepend '27'
+            formatted_phone = '27' + digits_only[1:]
+        else:
+            raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '0' must be 10 digits long.")
+    elif original_phone.startswith('27'):
+        if len(digits_only) == 11 and digits_only.startswith('27'):
+            # No change needed, already in '27' format
+            formatted_phone = digits_only
+        else:
+            raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '27' must be 11 digits long.")
+    elif original_phone.startswith('+27'):
+        if len(digits_only) == 11 and digits_only.startswith('27'):
+            formatted_phone = digits_only
+        else:
+            raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '+27' must have 11 digits after the prefix (e.g., '+27721234567').")
+    else:
+        raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Must start with '0', '27', or '+27'.")
+
+    # Final check for the expected 11-character format (27XXXXXXXXX)
+    if len(formatted_phone) != 11:
+        raise ValueError(f"Internal error: Formatted phone number '{formatted_phone}' has incorrect length. Expected 11 characters (27XXXXXXXXX).")
+
+    return formatted_phone
 
 class PhoneValidatorService:
     @staticmethod
     def _clean_and_validate_phone(phone: str) -> str:
         """
-        Cleans and validates a South African phone number according to specified rules.
-        Ensures it's in 27XXXXXXXXX format (11 characters).
-        Raises ValueError for invalid formats.
+        Cleans and validates a South African phone number into 27XXXXXXXXX format.
+        Raises ValueError for invalid formats. See _clean_and_validate_phone_impl.
         """
-        original_phone = phone
-        digits_only = re.sub(r'\D', '', phone)
-
-        if not digits_only:
-            raise ValueError("Phone number cannot be empty.")
-
-        formatted_phone = None
-
-        if original_phone.startswith('0'):
-            if len(digits_only) == 10 and digits_only.startswith('0'):
-                # Remove leading '0' and prepend '27'
-                formatted_phone = '27' + digits_only[1:]
-            else:
-                raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '0' must be 10 digits long.")
-        elif original_phone.startswith('27'):
-            if len(digits_only) == 11 and digits_only.startswith('27'):
-                # No change needed, already in '27' format
-                formatted_phone = digits_only
-            else:
-                raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '27' must be 11 digits long.")
-        elif original_phone.startswith('+27'):
-            if len(digits_only) == 11 and digits_only.startswith('27'):
-                formatted_phone = digits_only
-            else:
-                raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Numbers starting with '+27' must have 11 digits after the prefix (e.g., '+27721234567').")
-        else:
-            raise ValueError(f"Invalid South African phone number format: '{original_phone}'. Must start with '0', '27', or '+27'.")
+        return _clean_and_validate_phone_impl(phone)
 
-        # Final check for the expected 11-character format (27XXXXXXXXX)
-        if len(formatted_phone) != 11:
-            raise ValueError(f"Internal error: Formatted phone number '{formatted_phone}' has incorrect length. Expected 11 characters (27XXXXXXXXX).")
-
-        return formatted_phone
\ No newline at end of file
+    @staticmethod
+    def validate_many(phones: Iterable[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Cleans and validates a batch of phone numbers in one pass.
+        Returns a (formatted_phone, error) pair per input, in order; exactly one of the two is set.
+        """
+        validate = _clean_and_validate_phone_impl
+        results = []
+        for phone in phones:
+            try:
+                results.append((validate(phone), None))
+            except ValueError as e:
+                results.append((None, str(e)))
+        return results
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.sms_log import SMSLog
+
+logger = logging.getLogger("school_management")
+
+# Rows written per INSERT, and the longest a queued row waits before it is written
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_SECONDS = 0.25
+
+# PostgreSQL SQLSTATE raised when student_id refers to a deleted student
+FOREIGN_KEY_VIOLATION = "23503"
+
+def _is_connection_error(error: Exception) -> bool:
+    """Whether the error means the database could not be reached, so retrying rows is pointless."""
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError, OSError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+def _is_foreign_key_violation(error: Exception) -> bool:
+    return isinstance(error, IntegrityError) and getattr(error.orig, "sqlstate", None) == FOREIGN_KEY_VIOLATION
+
+class SMSLogWriter:
+    """
+    Writes SMS log rows from a single background task, so sends do not wait on the database.
+    Rows are inserted in batches of up to LOG_BATCH_SIZE, at most LOG_FLUSH_SECONDS after queueing.
+    """
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], max_queue_size: int = 10000):
+        self._session_factory = session_factory
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        """Starts the background writer. Call from the app's startup."""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes every queued row, then stops the background writer. Call from the app's shutdown."""
+        if self._task is None:
+            return
+        # From here on submit() hands rows back for the caller to write
+        task, self._task = self._task, None
+        if not task.done():
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                # The writer is still draining a full queue; it exits once the queue is empty
+                self._stopping = True
+            await asyncio.gather(task, return_exceptions=True)
+
+        # Rows left behind by a writer that died
+        rows = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                rows.append(row)
+        if rows:
+            await self._write(rows)
+
+    def submit(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Queues log rows for writing. Returns the rows that were not queued, because the queue
+        is full or the writer is not running, which the caller should write itself.
+        """
+        if self._task is None or self._task.done():
+            return rows
+        for position, row in enumerate(rows):
+            try:
+                self._queue.put_nowait(row)
+            except asyncio.QueueFull:
+                logger.warning(f"SMS log queue is full; {len(rows) - position} row(s) will be written inline")
+                return rows[position:]
+        return []
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            if self._stopping and self._queue.empty():
+                break
+            row = await self._queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + LOG_FLUSH_SECONDS
+            while len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            # A failed batch must not stop the writer, or every later row would be lost
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error(f"Failed to log {len(batch)} SMS result(s) to database: {e}")
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        error = await self._insert(batch)
+        if error is None:
+            return
+        if _is_connection_error(error):
+            logger.error(f"Dropped {len(batch)} SMS log row(s); the database is unreachable: {error}")
+            return
+        # One bad row fails the whole INSERT, so the rows are retried one by one
+        for position, row in enumerate(batch):
+            error = await self._insert([row])
+            if error is None:
+                continue
+            if _is_connection_error(error):
+                logger.error(f"Dropped {len(batch) - position} SMS log row(s); the database is unreachable: {error}")
+                return
+            if row.get("student_id") is not None and _is_foreign_key_violation(error):
+                # The student was deleted before the row was written; keep the log, unlinked
+                if await self._insert([{**row, "student_id": None}]) is None:
+                    logger.warning(f"Logged SMS result for {row['recipient_phone']} without its deleted student {row['student_id']}")
+                    continue
+            logger.error(f"Dropped SMS log row for {row.get('recipient_phone')} after it failed to write")
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> Optional[Exception]:
+        """Inserts rows in their own transaction. Returns the error, or None if the write succeeded."""
+        try:
+            async with self._session_factory() as session:
+                await session.execute(insert(SMSLog), rows)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to log {len(rows)} SMS result(s) to database: {e}")
+            return e
+        return None
@@ -1,41 +1,98 @@
 import httpx
+import orjson
 from app.config import Settings
 from app.services.phone_validator import PhoneValidatorService
-from app.utils.logger import setup_logger
+from app.services.sms_log_writer import SMSLogWriter
 from app.models.sms_log import SMSLog
-from app.schemas.sms_log import SMSLogCreate
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import asyncio
-import re
+import logging
+import time
+from collections import OrderedDict
 import socket # Import socket for DNS lookup
 
-logger = setup_logger()
+logger = logging.getLogger("school_management")
+
+# A slow resolver should not hold up startup; httpx resolves again on the first request anyway
+DNS_WARMUP_TIMEOUT_SECONDS = 5.0
+
+# Delivery statuses polled again within this window are answered from memory.
+# Shared by every SMSService, since a service instance only lives for one request.
+STATUS_CACHE_TTL_SECONDS = 30.0
+STATUS_CACHE_MAX_SIZE = 10000
+# Keyed by str(apiMessageId), since the API and callers may not agree on int vs str;
+# kept in least-recently-used order so a full cache evicts the oldest entry
+_status_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def _cache_status(key: str, fetched_at: float, message_status: Dict[str, Any]):
+    _status_cache[key] = (fetched_at, message_status)
+    _status_cache.move_to_end(key)
+    if len(_status_cache) > STATUS_CACHE_MAX_SIZE:
+        _status_cache.popitem(last=False)
+
+class _SafeDict(dict):
+    """Template variables mapping that renders missing placeholders as empty strings."""
+    def __missing__(self, key):
+        return ""
+
+def create_sms_client(settings: Settings) -> httpx.AsyncClient:
+    """
+    Builds the WinSMS HTTP client. The app creates one at startup and shares it across
+    requests, so keep-alive connections (and their TLS sessions) outlive a single request.
+    """
+    headers = {
+        "AUTHORIZATION": settings.winsms_api_key.strip(),
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    # Auth headers, timeouts and keep-alive pooling are set once on the client, not per request
+    # HTTP/2 multiplexes concurrent batch sends and status calls over one TLS connection
+    return httpx.AsyncClient(
+        base_url=settings.winsms_api_url,
+        headers=headers,
+        http2=True,
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=settings.sms_concurrency,
+            max_connections=settings.sms_concurrency * 2,
+            keepalive_expiry=60
+        )
+    )
+
+async def warm_up_sms_client(client: httpx.AsyncClient):
+    """
+    Resolves the WinSMS host once at startup to check connectivity and prime the resolver cache.
+    Runs on the event loop's resolver, so it never blocks request handling.
+    """
+    hostname = client.base_url.host
+    try:
+        addresses = await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(hostname, 443, type=socket.SOCK_STREAM),
+            timeout=DNS_WARMUP_TIMEOUT_SECONDS
+        )
+        logger.info(f"Successfully resolved {hostname} to {addresses[0][4][0]}")
+    except asyncio.TimeoutError:
+        logger.error(f"DNS resolution timed out for {hostname} after {DNS_WARMUP_TIMEOUT_SECONDS}s")
+    except socket.gaierror as e:
+        logger.error(f"DNS resolution failed for {hostname}: {e}")
 
 class SMSService:
-    def __init__(self, settings: Settings, db: AsyncSession):
+    def __init__(self, settings: Settings, db: AsyncSession, client: Optional[httpx.AsyncClient] = None,
+                 log_writer: Optional[SMSLogWriter] = None):
         self.settings = settings
         self.db = db
+        # With a log writer, SMS log rows are written in the background instead of on self.db
+        self.log_writer = log_writer
         self.phone_validator = PhoneValidatorService()
-        self.client = httpx.AsyncClient(base_url=settings.winsms_api_url)
         self.api_key = settings.winsms_api_key.strip()
-        
-        self.headers = {
-            "AUTHORIZATION": self.api_key,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+
+        # Without a shared client (e.g. in scripts) the service owns one and close() releases it
+        self._owns_client = client is None
+        self.client = client if client is not None else create_sms_client(settings)
         logger.info(f"SMSService initialized with Base URL: {settings.winsms_api_url} and API Key (first 5 chars): {self.api_key[:5]}*****")
-        
-        try:
-            # Perform a DNS lookup to check connectivity
-            hostname = self.client.base_url.host
-            ip_address = socket.gethostbyname(hostname)
-            logger.info(f"Successfully resolved {hostname} to {ip_address}")
-        except socket.gaierror as e:
-            logger.error(f"DNS resolution failed for {hostname}: {e}")
-            # Depending on desired behavior, you might want to raise an exception or set a flag here
-        
+
         self.message_templates = {
             "fee_notification": "Dear Parent, {student_name}'s school fees are {fee_status}.",
             "general_announcement": "Dear Parent, {message_body}",
@@ -50,13 +107,30 @@ class SMSService:
         if not template:
             raise ValueError(f"Message template '{template_name}' not found.")
 
-        rendered_message = template
-        for key, value in kwargs.items():
-            rendered_message = rendered_message.replace(f"{{{key}}}", str(value))
+        # One C-level substitution pass; unreplaced placeholders render as empty strings
+        return template.format_map(_SafeDict(kwargs))
 
-        # Remove any remaining unreplaced placeholders
-        rendered_message = re.sub(r"\{.*?\}", "", rendered_message)
-        return rendered_message
+    def _build_sms_log(self, student_id: Optional[str], recipient_phone: str,
+                       message: str, status: str, error_detail: Optional[str] = None,
+                       api_message_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Helper method to build an SMS log row, or None if it cannot be logged.
+        Rows are built directly rather than through SMSLogCreate; only the length limits
+        the schema enforces (and the recipient_phone column needs) are checked.
+        """
+        if not (10 <= len(recipient_phone) <= 12) or not message:
+            logger.error(f"Failed to log SMS result to database: invalid log fields for recipient '{recipient_phone}'")
+            return None
+        return {
+            "student_id": student_id,
+            "recipient_phone": recipient_phone,
+            "message_content": message,
+            "status": status,
+            "error_detail": error_detail,
+            "api_message_id": api_message_id,
+            "is_bulk": False,
+            "template_name": None
+        }
 
     async def _log_sms_result(self, student_id: Optional[str], recipient_phone: str,
                              message: str, status: str, error_detail: Optional[str] = None,
@@ -64,22 +138,33 @@ class SMSService:
         """
         Helper method to log SMS results to database asynchronously.
         """
+        sms_log = self._build_sms_log(student_id, recipient_phone, message, status, error_detail, api_message_id)
+        if sms_log is None:
+            return
+        if self.log_writer is not None and not self.log_writer.submit([sms_log]):
+            return
+        self.db.add(SMSLog(**sms_log))
+
+    async def _write_sms_logs(self, sms_logs: List[Optional[Dict[str, Any]]]):
+        """
+        Helper method to write the SMS log rows collected by a bulk send in a single multi-row INSERT.
+        """
+        rows = [row for row in sms_logs if row is not None]
+        if self.log_writer is not None:
+            rows = self.log_writer.submit(rows)
+        if not rows:
+            return
         try:
-            sms_log = SMSLogCreate(
-                student_id=student_id,
-                recipient_phone=recipient_phone,
-                message_content=message,
-                status=status,
-                error_detail=error_detail,
-                api_message_id=api_message_id
-            )
-            self.db.add(SMSLog(**sms_log.dict()))
+            # A savepoint keeps a failed INSERT from aborting the caller's transaction,
+            # which would otherwise fail the request after the messages already went out
+            async with self.db.begin_nested():
+                await self.db.execute(insert(SMSLog), rows)
         except Exception as e:
-            logger.error(f"Failed to log SMS result to database: {e}")
+            logger.error(f"Failed to log {len(rows)} SMS result(s) to database: {e}")
 
     async def send_sms(self, to: str, message: str, student_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        Sends an SMS message using the BulkSMS API.
+        Sends an SMS message using the WinSMS API.
         """
         try:
             validated_to = self.phone_validator._clean_and_validate_phone(to)
@@ -98,11 +183,10 @@ class SMSService:
         }
 
         try:
+            # Serialized with orjson; the client already sends the JSON Content-Type header
             response = await self.client.post(
                 "/sms/outgoing/send",
-                json=payload,
-                headers=self.headers,
-                timeout=30
+                content=orjson.dumps(payload)
             )
             
             response.raise_for_status()
@@ -138,90 +222,152 @@ class SMSService:
     async def send_bulk_sms(self, recipients: List[str], message: str) -> List[Dict[str, Any]]:
         """
         Sends bulk SMS messages using the WinSMS API.
+        Duplicate recipients, including differently formatted copies of one number, get one message.
+        Recipients are sent in requests of up to sms_batch_size numbers each.
         """
-        messages_payload = []
         processed_results = []
+        sms_logs = []
+        group: List[Tuple[int, str, Optional[str]]] = []
 
-        for recipient in recipients:
-            try:
-                validated_to = self.phone_validator._clean_and_validate_phone(recipient)
-                messages_payload.append({
-                    "mobileNumber": validated_to
-                })
-            except ValueError as e:
-                logger.error(f"Bulk SMS failed for recipient {recipient}: Invalid phone number - {e}")
-                await self._log_sms_result(None, recipient, message, "failed", f"Invalid phone number: {e}")
-                processed_results.append({"to": recipient, "status": "failed", "detail": f"Invalid phone number: {e}"})
-        
-        if not messages_payload:
-            return processed_results # No valid recipients to send to
+        # Parents often share a number across children, so each number is validated and sent once
+        unique_recipients = list(dict.fromkeys(recipients))
+        validated_recipients = self.phone_validator.validate_many(unique_recipients)
+        validated_numbers = set()
+        for recipient, (validated_to, error) in zip(unique_recipients, validated_recipients):
+            if error is None:
+                if validated_to in validated_numbers:
+                    continue # A differently formatted copy of a number already queued
+                validated_numbers.add(validated_to)
+                group.append((len(group), validated_to, None))
+            else:
+                logger.error(f"Bulk SMS failed for recipient {recipient}: Invalid phone number - {error}")
+                sms_logs.append(self._build_sms_log(None, recipient, message, "failed", f"Invalid phone number: {error}"))
+                processed_results.append({"to": recipient, "status": "failed", "detail": f"Invalid phone number: {error}"})
+
+        if group:
+            group_results = await self._send_message_groups({message: group}, sms_logs)
+            processed_results.extend(result for _, result in sorted(group_results, key=lambda r: r[0]))
+
+        await self._write_sms_logs(sms_logs)
+        return processed_results
 
+    async def send_bulk_personalized(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sends individually addressed SMS messages using the WinSMS API.
+
+        Each item needs "to" and "message" keys and may carry a "student_id".
+        Recipients sharing the same message body are combined into requests of up to
+        sms_batch_size numbers, and those requests run concurrently (bounded by sms_concurrency).
+        Results are returned in the same order as the input items.
+        """
+        processed_results: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+        message_groups: Dict[str, List[Tuple[int, str, Optional[str]]]] = {}
+        sms_logs: List[Optional[Dict[str, Any]]] = []
+
+        validated_recipients = self.phone_validator.validate_many([item["to"] for item in messages])
+        for index, (item, (validated_to, error)) in enumerate(zip(messages, validated_recipients)):
+            recipient = item["to"]
+            message = item["message"]
+            student_id = item.get("student_id")
+            if error is not None:
+                logger.error(f"SMS send failed for student {student_id} to {recipient}: Invalid phone number - {error}")
+                sms_logs.append(self._build_sms_log(student_id, recipient, message, "failed", f"Invalid phone number: {error}"))
+                processed_results[index] = {
+                    "to": recipient,
+                    "student_id": student_id,
+                    "status": "failed",
+                    "detail": f"Invalid phone number: {error}"
+                }
+                continue
+            message_groups.setdefault(message, []).append((index, validated_to, student_id))
+
+        for index, result in await self._send_message_groups(message_groups, sms_logs):
+            processed_results[index] = result
+
+        await self._write_sms_logs(sms_logs)
+        return processed_results
+
+    async def _send_message_groups(self, message_groups: Dict[str, List[Tuple[int, str, Optional[str]]]],
+                                   sms_logs: List[Optional[Dict[str, Any]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Sends each message body to its recipients in requests of up to sms_batch_size numbers,
+        with at most sms_concurrency requests in flight. Returns (input index, result) pairs.
+        """
+        batch_size = self.settings.sms_batch_size
+        semaphore = asyncio.Semaphore(self.settings.sms_concurrency)
+
+        async def send_batch(message: str, batch: List[Tuple[int, str, Optional[str]]]):
+            async with semaphore:
+                return await self._send_message_group(message, batch, sms_logs)
+
+        batch_results = await asyncio.gather(*(
+            send_batch(message, group[start:start + batch_size])
+            for message, group in message_groups.items()
+            for start in range(0, len(group), batch_size)
+        ))
+        return [pair for batch_result in batch_results for pair in batch_result]
+
+    async def _send_message_group(self, message: str,
+                                  group: List[Tuple[int, str, Optional[str]]],
+                                  sms_logs: List[Optional[Dict[str, Any]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Sends one message body to a group of validated recipients in a single WinSMS request.
+        Returns (input index, result) pairs for every recipient in the group and
+        appends their log rows to sms_logs.
+        """
         payload = {
             "message": message,
-            "recipients": messages_payload
+            "recipients": [{"mobileNumber": validated_to} for _, validated_to, _ in group]
         }
 
         try:
             response = await self.client.post(
                 "/sms/outgoing/send",
-                json=payload,
-                headers=self.headers,
-                timeout=30
+                content=orjson.dumps(payload)
             )
 
             response.raise_for_status()
             response_data = response.json()
 
             if response_data.get("statusCode") == 200 and response_data.get("recipients"):
-                for msg_result in response_data["recipients"]:
-                    recipient_phone = msg_result.get("mobileNumber")
+                api_results = {r.get("mobileNumber"): r for r in response_data["recipients"]}
+                group_results = []
+                for index, validated_to, student_id in group:
+                    msg_result = api_results.get(validated_to)
+                    if msg_result is None:
+                        error_msg = "No result returned by WinSMS API for recipient"
+                        logger.error(f"SMS send failed to {validated_to} for student {student_id}. Error: {error_msg}")
+                        sms_logs.append(self._build_sms_log(student_id, validated_to, message, "failed", error_msg))
+                        group_results.append((index, {"to": validated_to, "student_id": student_id, "status": "failed", "detail": error_msg}))
+                        continue
                     api_message_id = str(msg_result.get("apiMessageId")) if msg_result.get("apiMessageId") else None
-                    logger.info(f"Bulk SMS sent successfully to {recipient_phone}. WinSMS API Message ID: {api_message_id}")
-                    await self._log_sms_result(None, recipient_phone, message, "success", api_message_id=api_message_id)
-                    processed_results.append({
-                        "to": recipient_phone,
+                    logger.info(f"SMS sent successfully to {validated_to} for student {student_id}. WinSMS API Message ID: {api_message_id}")
+                    sms_logs.append(self._build_sms_log(student_id, validated_to, message, "success", api_message_id=api_message_id))
+                    group_results.append((index, {
+                        "to": validated_to,
+                        "student_id": student_id,
                         "status": "success",
                         "detail": msg_result,
                         "message_id": api_message_id
-                    })
-            else:
-                error_msg = response_data.get("errorMessage", "Unknown error from WinSMS API")
-                logger.error(f"Bulk SMS send failed. Error: {error_msg}")
-                # Log failures for all recipients in the payload if the entire request failed
-                for msg_data in messages_payload:
-                    recipient_phone = msg_data.get("mobileNumber")
-                    if recipient_phone not in [res.get("to") for res in processed_results]: # Avoid double logging if already failed due to validation
-                        await self._log_sms_result(None, recipient_phone, message, "failed", error_msg)
-                        processed_results.append({"to": recipient_phone, "status": "failed", "detail": error_msg})
+                    }))
+                return group_results
+
+            error_msg = response_data.get("errorMessage", "Unknown error from WinSMS API")
 
         except httpx.RequestError as e:
             error_msg = f"Network error: {e}"
-            logger.error(f"Bulk SMS send failed: {error_msg}")
-            for msg_data in messages_payload:
-                recipient_phone = msg_data.get("mobileNumber")
-                if recipient_phone not in [res.get("to") for res in processed_results]:
-                    await self._log_sms_result(None, recipient_phone, message, "failed", error_msg)
-                    processed_results.append({"to": recipient_phone, "status": "failed", "detail": error_msg})
-        
         except httpx.HTTPStatusError as e:
             error_msg = f"HTTP {e.response.status_code}: {e.response.text}"
-            logger.error(f"Bulk SMS send failed: {error_msg}")
-            for msg_data in messages_payload:
-                recipient_phone = msg_data.get("mobileNumber")
-                if recipient_phone not in [res.get("to") for res in processed_results]:
-                    await self._log_sms_result(None, recipient_phone, message, "failed", error_msg)
-                    processed_results.append({"to": recipient_phone, "status": "failed", "detail": error_msg})
-        
         except Exception as e:
             error_msg = f"Unexpected error: {e}"
-            logger.error(f"Unexpected error while sending bulk SMS: {e}")
-            for msg_data in messages_payload:
-                recipient_phone = msg_data.get("mobileNumber")
-                if recipient_phone not in [res.get("to") for res in processed_results]:
-                    await self._log_sms_result(None, recipient_phone, message, "failed", error_msg)
-                    processed_results.append({"to": recipient_phone, "status": "failed", "detail": error_msg})
 
-        return processed_results
+        # The whole request failed, so every recipient in the group failed
+        logger.error(f"SMS send failed for {len(group)} recipient(s). Error: {error_msg}")
+        group_results = []
+        for index, validated_to, student_id in group:
+            sms_logs.append(self._build_sms_log(student_id, validated_to, message, "failed", error_msg))
+            group_results.append((index, {"to": validated_to, "student_id": student_id, "status": "failed", "detail": error_msg}))
+        return group_results
 
     async def get_credit_balance(self) -> Dict[str, Any]:
         """
@@ -229,9 +375,7 @@ class SMSService:
         """
         try:
             response = await self.client.get(
-                "/credits/balance",
-                headers=self.headers,
-                timeout=30
+                "/credits/balance"
             )
             response.raise_for_status()
             response_data = response.json()
@@ -260,26 +404,56 @@ class SMSService:
         """
         Retrieves the status of a single SMS message using the WinSMS API.
         Refactored to use the multiple status endpoint with a single ID.
+        To poll several messages, call get_multiple_message_statuses once with all
+        their IDs rather than this in a loop, which costs one request per message.
         """
         return await self.get_multiple_message_statuses(api_message_ids=[api_message_id])
 
     async def get_multiple_message_statuses(self, api_message_ids: List[int]) -> Dict[str, Any]:
         """
         Retrieves the status of multiple SMS messages using the WinSMS API.
+        Statuses fetched in the last STATUS_CACHE_TTL_SECONDS are served from memory,
+        and only the remaining IDs are requested.
         """
-        payload = {"apiMessageIds": api_message_ids}
+        now = time.monotonic()
+        statuses: Dict[str, Dict[str, Any]] = {}
+        ids_to_fetch = []
+        for api_message_id in api_message_ids:
+            key = str(api_message_id)
+            entry = _status_cache.get(key)
+            if entry is not None and now - entry[0] < STATUS_CACHE_TTL_SECONDS:
+                _status_cache.move_to_end(key)
+                statuses[key] = entry[1]
+            else:
+                ids_to_fetch.append(api_message_id)
+
+        if not ids_to_fetch:
+            logger.info(f"WinSMS multiple message statuses served from cache for IDs: {api_message_ids}")
+            messages = [statuses[str(api_message_id)] for api_message_id in api_message_ids]
+            return {"status": "success", "detail": {"statusCode": 200, "messages": messages}}
+        has_cached = bool(statuses)
+
+        payload = {"apiMessageIds": ids_to_fetch}
         try:
             response = await self.client.post(
                 "/sms/outgoing/status",
-                json=payload,
-                headers=self.headers,
-                timeout=30
+                content=orjson.dumps(payload)
             )
             response.raise_for_status()
             response_data = response.json()
 
             if response_data.get("statusCode") == 200 and response_data.get("messages"):
-                logger.info(f"WinSMS multiple message statuses retrieved for IDs: {api_message_ids}")
+                logger.info(f"WinSMS multiple message statuses retrieved for IDs: {ids_to_fetch}")
+                for message_status in response_data["messages"]:
+                    key = str(message_status.get("apiMessageId"))
+                    _cache_status(key, now, message_status)
+                    statuses[key] = message_status
+                if has_cached:
+                    # Merge cached and fetched statuses back into the order they were asked for
+                    response_data = {**response_data, "messages": [
+                        statuses[str(api_message_id)] for api_message_id in api_message_ids
+                        if str(api_message_id) in statuses
+                    ]}
                 return {"status": "success", "detail": response_data}
             else:
                 error_msg = response_data.get("errorMessage", "Unknown error getting multiple message statuses from WinSMS API")
@@ -303,9 +477,7 @@ class SMSService:
         """
         try:
             response = await self.client.get(
-                "/sms/incoming",
-                headers=self.headers,
-                timeout=30
+                "/sms/incoming"
             )
             response.raise_for_status()
             response_data = response.json()
@@ -330,5 +502,6 @@ class SMSService:
             return {"status": "failed", "detail": f"Unexpected error: {e}"}
 
     async def close(self):
-        """Close the HTTP client."""
-        await self.client.aclose()
+        """Close the HTTP client, unless it is the shared one owned by the app."""
+        if self._owns_client:
+            await self.client.aclose()
@@ -1,141 +1,270 @@
+import asyncio
 import csv
-from io import StringIO
-from typing import List, Dict, Any
-from pydantic import ValidationError
+import itertools
+import logging
+import asyncpg
+from typing import List, Dict, Any, Tuple, Iterable, Iterator, Set
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import text, func, literal_column
+from sqlalchemy.dialects.postgresql import insert
 
 from app.schemas.csv_student import CSVStudent
 from app.models.student import Student
-from app.utils.logger import setup_logger
 
-logger = setup_logger()
+logger = logging.getLogger("school_management")
+
+# Rows held in memory and written per COPY round trip
+IMPORT_BATCH_SIZE = 5000
+
+# Below this many students, staging a COPY costs more than a multi-row INSERT
+COPY_MIN_ROWS = 500
+
+IMPORT_COLUMNS = ["name", "grade", "class_letter", "parent1_phone", "parent2_phone", "fee_status"]
+
+# Staging table for COPY; dropped automatically when the import transaction ends
+_CREATE_STAGING_TABLE = text("""
+    CREATE TEMP TABLE students_import (
+        name VARCHAR(255) NOT NULL,
+        grade VARCHAR(10) NOT NULL,
+        class_letter VARCHAR(1) NOT NULL,
+        parent1_phone VARCHAR(12) NOT NULL,
+        parent2_phone VARCHAR(12),
+        fee_status VARCHAR(20) NOT NULL
+    ) ON COMMIT DROP
+""")
+
+_CLEAR_STAGING_TABLE = text("TRUNCATE students_import")
+
+# xmax is 0 only for freshly inserted rows, which tells created and updated students apart
+_UPSERT_FROM_STAGING = text("""
+    INSERT INTO students (id, name, grade, class_letter, parent1_phone, parent2_phone, fee_status)
+    SELECT gen_random_uuid(), name, grade, class_letter, parent1_phone, parent2_phone, fee_status
+    FROM students_import
+    ON CONFLICT (name, grade, class_letter) DO UPDATE SET
+        parent1_phone = EXCLUDED.parent1_phone,
+        parent2_phone = EXCLUDED.parent2_phone,
+        fee_status = EXCLUDED.fee_status,
+        updated_at = now()
+    RETURNING name, grade, class_letter, (xmax = 0) AS inserted
+""")
+
+StudentKey = Tuple[str, str, str]
+
+# Validates a whole batch in one call into pydantic-core instead of one model call per row
+_CSV_STUDENTS_ADAPTER = TypeAdapter(List[CSVStudent])
+
+def _read_and_validate_batch(csv_reader: Iterator[Dict[str, str]], first_row_number: int,
+                             batch_size: int) -> Tuple[List[Tuple[int, CSVStudent]], List[Dict[str, Any]], int]:
+    """
+    Reads up to batch_size rows from csv_reader and validates them.
+    Returns the (row number, student) pairs that passed, the failure entries for those
+    that did not, and the number of rows read.
+    """
+    invalid_rows = []
+    rows = []  # (row number, raw row, cleaned row)
+    rows_read = 0
+
+    for row_number, row in enumerate(itertools.islice(csv_reader, batch_size), start=first_row_number):
+        rows_read += 1
+        try:
+            # Keys were normalized once on the reader's fieldnames; only values need stripping
+            rows.append((row_number, row, {k: v.strip() for k, v in row.items()}))
+        except Exception as e:
+            invalid_rows.append({
+                "row": row_number,
+                "data": row,
+                "errors": str(e)
+            })
+            logger.error(f"Unexpected error for row {row_number} in CSV: {e}")
+
+    try:
+        students = _CSV_STUDENTS_ADAPTER.validate_python([cleaned for _, _, cleaned in rows])
+    except ValidationError as e:
+        # Errors are located as (index in batch, field, ...); report them per row and
+        # validate the rows that passed again on their own
+        row_errors: Dict[int, List[Dict[str, Any]]] = {}
+        for err in e.errors():
+            row_errors.setdefault(err["loc"][0], []).append(err)
+        for index, errors in row_errors.items():
+            row_number, row, _ = rows[index]
+            invalid_rows.append({
+                "row": row_number,
+                "data": row,
+                "errors": [{"field": err["loc"][1:], "message": err["msg"]} for err in errors]
+            })
+            logger.warning(f"Validation error for row {row_number} in CSV: {errors}")
+        rows = [item for index, item in enumerate(rows) if index not in row_errors]
+        students = _CSV_STUDENTS_ADAPTER.validate_python([cleaned for _, _, cleaned in rows])
+
+    validated_rows = [(row_number, student) for (row_number, _, _), student in zip(rows, students)]
+    return validated_rows, invalid_rows, rows_read
 
 class StudentImporterService:
     @staticmethod
-    async def import_students_from_csv(db: AsyncSession, csv_file_content: str) -> Dict[str, Any]:
+    async def import_students_from_csv(db: AsyncSession, csv_lines: Iterable[str]) -> Dict[str, Any]:
+        """
+        Imports students from CSV text lines (a text file object or any iterable of lines).
+
+        Rows are read and validated in a worker thread in batches of IMPORT_BATCH_SIZE, and
+        each batch is written while the next one is validated, so memory use is bounded by
+        the batch rather than the whole file and the event loop stays free for other requests.
+        """
         successful_imports = []
         failed_imports = []
-        
-        csv_reader = csv.DictReader(StringIO(csv_file_content))
-        
-        for i, row in enumerate(csv_reader):
-            row_number = i + 2  # +1 for 0-based index, +1 for header row
-            
-            # Create a savepoint for this individual row
-            savepoint = await db.begin_nested()
-            
-            try:
-                # Clean up keys to match Pydantic schema
-                cleaned_row = {k.strip().lower(): v.strip() for k, v in row.items()}
-                
-                csv_student_data = CSVStudent(**cleaned_row)
-
-                # Check if student already exists
-                existing_student_query = await db.execute(
-                    select(Student).where(
-                        Student.name == csv_student_data.name,
-                        Student.grade == csv_student_data.grade,
-                        Student.class_letter == csv_student_data.class_letter
-                    )
-                )
-                existing_student = existing_student_query.scalar_one_or_none()
-
-                if existing_student:
-                    # Update existing student
-                    existing_student.parent1_phone = csv_student_data.parent1_phone
-                    existing_student.parent2_phone = csv_student_data.parent2_phone
-                    existing_student.fee_status = csv_student_data.fee_status
-                    await savepoint.commit()
-                    successful_imports.append({
-                        "row": row_number, 
-                        "name": csv_student_data.name, 
-                        "status": "updated"
-                    })
-                    logger.info(f"Successfully updated existing student from CSV: {csv_student_data.name}")
-                else:
-                    # Create a new Student model instance
-                    db_student = Student(
-                        name=csv_student_data.name,
-                        grade=csv_student_data.grade,
-                        class_letter=csv_student_data.class_letter,
-                        parent1_phone=csv_student_data.parent1_phone,
-                        parent2_phone=csv_student_data.parent2_phone,
-                        fee_status=csv_student_data.fee_status
-                    )
-                    db.add(db_student)
-                    await savepoint.commit()
-                    successful_imports.append({
-                        "row": row_number, 
-                        "name": csv_student_data.name, 
-                        "status": "created"
-                    })
-                    logger.info(f"Successfully created new student from CSV: {csv_student_data.name}")
-
-            except ValidationError as e:
-                await savepoint.rollback()
-                failed_imports.append({
-                    "row": row_number, 
-                    "data": row, 
-                    "errors": [{"field": err["loc"], "message": err["msg"]} for err in e.errors()]
-                })
-                logger.warning(f"Validation error for row {row_number} in CSV: {e.errors()}")
-                
-            except IntegrityError as e:
-                await savepoint.rollback()
-                # This shouldn't happen given our upsert logic, but just in case
-                if "duplicate key value violates unique constraint" in str(e):
-                    failed_imports.append({
-                        "row": row_number, 
-                        "data": row, 
-                        "errors": f"Duplicate student: {csv_student_data.name if 'csv_student_data' in locals() else 'Unknown'}"
-                    })
-                    logger.warning(f"Duplicate key constraint violation for row {row_number}: {csv_student_data.name if 'csv_student_data' in locals() else 'Unknown'}")
+        write_error = None
+        staging_table_created = False
+
+        # Validated rows keyed by (name, grade, class_letter); a later row for the same
+        # student overrides the earlier one, as it would have when rows were saved one by one
+        students: Dict[StudentKey, CSVStudent] = {}
+        row_numbers: Dict[StudentKey, List[int]] = {}
+
+        async def flush_batch():
+            nonlocal write_error, staging_table_created
+            if write_error is None:
+                try:
+                    if len(students) < COPY_MIN_ROWS:
+                        inserted_keys = await StudentImporterService._insert_and_upsert(db, students.values())
+                    else:
+                        inserted_keys = await StudentImporterService._copy_and_upsert(
+                            db, students.values(), create_staging_table=not staging_table_created
+                        )
+                        staging_table_created = True
+                except (SQLAlchemyError, asyncpg.PostgresError) as e:
+                    write_error = e
                 else:
-                    failed_imports.append({
-                        "row": row_number, 
-                        "data": row, 
-                        "errors": str(e)
-                    })
-                    logger.error(f"Integrity constraint violation for row {row_number}: {e}")
-                    
-            except SQLAlchemyError as e:
-                await savepoint.rollback()
-                failed_imports.append({
-                    "row": row_number, 
-                    "data": row, 
-                    "errors": str(e)
-                })
-                logger.error(f"Database error for row {row_number} in CSV: {e}")
-                
-            except Exception as e:
-                await savepoint.rollback()
-                failed_imports.append({
-                    "row": row_number, 
-                    "data": row, 
-                    "errors": str(e)
-                })
-                logger.error(f"Unexpected error for row {row_number} in CSV: {e}")
-
-        # Commit all successful changes
+                    for key, numbers in row_numbers.items():
+                        for position, row_number in enumerate(numbers):
+                            # Repeated rows for a student update the record created by the first
+                            created = position == 0 and key in inserted_keys
+                            successful_imports.append({
+                                "row": row_number,
+                                "name": key[0],
+                                "status": "created" if created else "updated"
+                            })
+            if write_error is not None:
+                # Once a write fails the transaction is aborted, so later batches are not sent
+                for key, numbers in row_numbers.items():
+                    for row_number in numbers:
+                        failed_imports.append({
+                            "row": row_number,
+                            "name": key[0],
+                            "status": "failed_on_commit",
+                            "errors": str(write_error)
+                        })
+            students.clear()
+            row_numbers.clear()
+
+        csv_reader = csv.DictReader(csv_lines)
+        # Clean up the header once so rows come out keyed to match the Pydantic schema
+        if csv_reader.fieldnames:
+            csv_reader.fieldnames = [name.strip().lower() for name in csv_reader.fieldnames]
+        row_number = 2  # +1 for 1-based numbering, +1 for header row
+
+        def read_next_batch(first_row_number: int):
+            # Reading and validating are blocking, CPU-bound work, so they run off the event loop
+            return asyncio.create_task(asyncio.to_thread(
+                _read_and_validate_batch, csv_reader, first_row_number, IMPORT_BATCH_SIZE
+            ))
+
+        next_batch = read_next_batch(row_number)
         try:
-            await db.commit()
-            logger.info(f"CSV import complete. Successful: {len(successful_imports)}, Failed: {len(failed_imports)}")
-        except SQLAlchemyError as e:
+            while True:
+                validated_rows, invalid_rows, rows_read = await next_batch
+                if not rows_read:
+                    break
+                row_number += rows_read
+                # Validate the following batch while this one is written
+                next_batch = read_next_batch(row_number)
+
+                failed_imports.extend(invalid_rows)
+                for batch_row_number, csv_student_data in validated_rows:
+                    key = (csv_student_data.name, csv_student_data.grade, csv_student_data.class_letter)
+                    students[key] = csv_student_data
+                    row_numbers.setdefault(key, []).append(batch_row_number)
+                if students:
+                    await flush_batch()
+        finally:
+            # Let an in-flight read finish before the caller releases the file
+            await asyncio.gather(next_batch, return_exceptions=True)
+
+        if write_error is None and successful_imports:
+            try:
+                await db.commit()
+            except SQLAlchemyError as e:
+                write_error = e
+
+        if write_error is not None:
             await db.rollback()
-            logger.critical(f"Final database commit failed for CSV import: {e}")
-            # Mark all as failed due to commit failure
-            all_failed = successful_imports + failed_imports
-            failed_imports = []
-            for item in all_failed:
+            logger.critical(f"Database write failed for CSV import: {write_error}")
+            # Every written row shared the failed transaction
+            for item in successful_imports:
                 item["status"] = "failed_on_commit"
-                item["errors"] = str(e)
+                item["errors"] = str(write_error)
                 failed_imports.append(item)
             successful_imports = []
 
+        successful_imports.sort(key=lambda item: item["row"])
+        failed_imports.sort(key=lambda item: item["row"])
+        logger.info(f"CSV import complete. Successful: {len(successful_imports)}, Failed: {len(failed_imports)}")
+
         return {
             "total_rows_processed": len(successful_imports) + len(failed_imports),
             "successful_imports": successful_imports,
             "failed_imports": failed_imports
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    async def _copy_and_upsert(db: AsyncSession, students: Iterable[CSVStudent],
+                               create_staging_table: bool = True) -> Set[StudentKey]:
+        """
+        Bulk loads validated students with COPY into a staging table, then upserts them into
+        students in one statement. Returns the keys of the students that were newly created.
+        """
+        if create_staging_table:
+            await db.execute(_CREATE_STAGING_TABLE)
+        else:
+            await db.execute(_CLEAR_STAGING_TABLE)
+
+        # COPY is only exposed by the asyncpg driver connection, which shares the session's transaction
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "students_import",
+            records=[
+                (s.name, s.grade, s.class_letter, s.parent1_phone, s.parent2_phone, s.fee_status)
+                for s in students
+            ],
+            columns=IMPORT_COLUMNS
+        )
+
+        result = await db.execute(_UPSERT_FROM_STAGING)
+        return {(row.name, row.grade, row.class_letter) for row in result if row.inserted}
+
+    @staticmethod
+    async def _insert_and_upsert(db: AsyncSession, students: Iterable[CSVStudent]) -> Set[StudentKey]:
+        """
+        Upserts a small batch of validated students with a single multi-row INSERT.
+        Returns the keys of the students that were newly created.
+        """
+        query = insert(Student).values([
+            {column: getattr(s, column) for column in IMPORT_COLUMNS}
+            for s in students
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[Student.name, Student.grade, Student.class_letter],
+            set_={
+                "parent1_phone": query.excluded.parent1_phone,
+                "parent2_phone": query.excluded.parent2_phone,
+                "fee_status": query.excluded.fee_status,
+                "updated_at": func.now(),
+            }
+        ).returning(
+            Student.name, Student.grade, Student.class_letter,
+            literal_column("(xmax = 0)").label("inserted")
+        )
+
+        result = await db.execute(query)
+        return {(row.name, row.grade, row.class_letter) for row in result if row.inserted}
@@ -1,11 +1,18 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 from app.config import get_settings
 
+# Runs the console and file handlers on its own thread; see setup_logger
+_listener = None
+
 def setup_logger(level: str = "INFO") -> logging.Logger:
     """
     Set up and configure the application logger.
+    Called once at startup (the app's lifespan, or a script's entry point); modules get the
+    configured logger with logging.getLogger("school_management") instead of calling this.
 
     Args:
         level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
@@ -13,18 +20,21 @@ def setup_logger(level: str = "INFO") -> logging.Logger:
     Returns:
         logging.Logger: Configured logger instance
     """
+    global _listener
+
     # Create logs directory if it doesn't exist
     os.makedirs("logs", exist_ok=True)
 
     # Create a logger
     logger = logging.getLogger("school_management")
-    logger.setLevel(getattr(logging, level.upper(), logging.INFO))
+    log_level = getattr(logging, level.upper(), logging.INFO)
+    logger.setLevel(log_level)
 
     # Prevent adding multiple handlers if this function is called multiple times
     if not logger.handlers:
         # Create console handler
         ch = logging.StreamHandler()
-        ch.setLevel(getattr(logging, level.upper(), logging.INFO))
+        ch.setLevel(log_level)
 
         # Create file handler with rotation
         fh = RotatingFileHandler(
@@ -41,8 +51,13 @@ def setup_logger(level: str = "INFO") -> logging.Logger:
         ch.setFormatter(formatter)
         fh.setFormatter(formatter)
 
-        # Add the handlers to the logger
-        logger.addHandler(ch)
-        logger.addHandler(fh)
+        # The logger only enqueues records; console and file I/O (including rotation)
+        # happen on the listener's thread, so logging never blocks the event loop
+        log_queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+        _listener.start()
+        # Flush records still queued when the process exits
+        atexit.register(_listener.stop)
 
     return logger
\ No newline at end of file
@@ -1,4 +1,5 @@
-import requests
+import asyncio
+import httpx
 import json
 
 # Base URL for the local server
@@ -14,29 +15,35 @@ SMS_FEE_NOTIFICATION_ENDPOINT = f"{BASE_URL}/sms/fee-notification"
 SMS_BULK_ENDPOINT = f"{BASE_URL}/sms/bulk"
 SMS_HISTORY_ENDPOINT = f"{BASE_URL}/sms/history"
 
+# One client for every test, so its connection pool keeps the connection to the server alive
+CLIENT = httpx.Client()
+
 def test_students_endpoint():
-    response = requests.get(STUDENTS_ENDPOINT)
+    response = CLIENT.get(STUDENTS_ENDPOINT)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("Students endpoint test passed")
 
+# The student posted by test_create_student_endpoint, encoded once
+STUDENT_BODY = json.dumps({
+    "name": "Test Student",
+    "grade": "Grade 1",
+    "parent1_phone": "+1234567890",
+    "fee_status": "unpaid"
+}).encode()
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 def test_create_student_endpoint():
-    student_data = {
-        "name": "Test Student",
-        "grade": "Grade 1",
-        "parent1_phone": "+1234567890",
-        "fee_status": "unpaid"
-    }
-    response = requests.post(STUDENTS_ENDPOINT, json=student_data)
+    response = CLIENT.post(STUDENTS_ENDPOINT, content=STUDENT_BODY, headers=JSON_HEADERS)
     assert response.status_code == 201, f"Expected status code 201, but got {response.status_code}"
     print("Create student endpoint test passed")
 
 def test_student_statistics_endpoint():
-    response = requests.get(STUDENT_STATISTICS_ENDPOINT)
+    response = CLIENT.get(STUDENT_STATISTICS_ENDPOINT)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("Student statistics endpoint test passed")
 
 def test_student_grades_endpoint():
-    response = requests.get(STUDENT_GRADES_ENDPOINT)
+    response = CLIENT.get(STUDENT_GRADES_ENDPOINT)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("Student grades endpoint test passed")
 
@@ -45,7 +52,7 @@ def test_sms_fee_notification_endpoint():
         "student_ids": ["valid_student_id"],
         "template_name": "fee_notification_template"
     }
-    response = requests.post(SMS_FEE_NOTIFICATION_ENDPOINT, json=fee_notification_data)
+    response = CLIENT.post(SMS_FEE_NOTIFICATION_ENDPOINT, json=fee_notification_data)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("SMS fee notification endpoint test passed")
 
@@ -57,23 +64,42 @@ def test_sms_bulk_endpoint():
             "fee_status": "unpaid"
         }
     }
-    response = requests.post(SMS_BULK_ENDPOINT, json=bulk_sms_data)
+    response = CLIENT.post(SMS_BULK_ENDPOINT, json=bulk_sms_data)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("SMS bulk endpoint test passed")
 
 def test_sms_history_endpoint():
-    response = requests.get(SMS_HISTORY_ENDPOINT)
+    response = CLIENT.get(SMS_HISTORY_ENDPOINT)
     assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
     print("SMS history endpoint test passed")
 
-def main():
-    test_students_endpoint()
-    test_create_student_endpoint()
-    test_student_statistics_endpoint()
-    test_student_grades_endpoint()
-    test_sms_fee_notification_endpoint()
-    test_sms_bulk_endpoint()
-    test_sms_history_endpoint()
+async def main():
+    # The endpoint tests do not depend on each other, so they run concurrently
+    tests = (
+        test_students_endpoint,
+        test_create_student_endpoint,
+        test_student_statistics_endpoint,
+        test_student_grades_endpoint,
+        test_sms_fee_notification_endpoint,
+        test_sms_bulk_endpoint,
+        test_sms_history_endpoint
+    )
+    try:
+        # Wait for every test, so no thread is still using the client when it is closed
+        results = await asyncio.gather(*(asyncio.to_thread(test) for test in tests), return_exceptions=True)
+    finally:
+        CLIENT.close()
+
+    failures = [(test, result) for test, result in zip(tests, results) if isinstance(result, BaseException)]
+    for test, error in failures:
+        print(f"{test.__name__} failed: {error!r}")
+    if failures:
+        raise SystemExit(f"{len(failures)} of {len(tests)} endpoint tests failed")
 
 if __name__ == "__main__":
-    main()
+    try:
+        import uvloop  # Installed with uvicorn[standard]; not available on every platform
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(main())
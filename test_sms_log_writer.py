@@ -0,0 +1,207 @@
+import asyncio
+import pytest
+import app.models.student  # Registers Student, which the SMSLog relationship refers to
+from app.services import sms_log_writer
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app.services.sms_log_writer import SMSLogWriter, FOREIGN_KEY_VIOLATION
+
+def log_row(phone, student_id=None):
+    return {
+        "student_id": student_id,
+        "recipient_phone": phone,
+        "message_content": "Test message",
+        "status": "success",
+        "error_detail": None,
+        "api_message_id": None,
+        "is_bulk": False,
+        "template_name": None
+    }
+
+class FakeDriverError(Exception):
+    def __init__(self, message, sqlstate=None):
+        super().__init__(message)
+        self.sqlstate = sqlstate
+
+def foreign_key_error():
+    return IntegrityError("INSERT INTO sms_logs", {}, FakeDriverError("violates foreign key constraint", FOREIGN_KEY_VIOLATION))
+
+class FakeSessionFactory:
+    """
+    Stands in for the async_sessionmaker; records each committed batch of rows and every attempt.
+    A batch containing a phone listed in errors raises that phone's error, but only while the row
+    still has a student_id, so a retry without it would always succeed.
+    """
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.batches = []
+        self.attempts = 0
+
+    def __call__(self):
+        return FakeSession(self)
+
+class FakeSession:
+    def __init__(self, factory):
+        self.factory = factory
+        self.pending = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, rows):
+        self.factory.attempts += 1
+        for row in rows:
+            error = self.factory.errors.get(row["recipient_phone"])
+            if error is not None and row["student_id"] is not None:
+                raise error
+        self.pending = rows
+
+    async def commit(self):
+        self.factory.batches.append([(row["recipient_phone"], row["student_id"]) for row in self.pending])
+
+def phones(batches):
+    return [[phone for phone, _ in batch] for batch in batches]
+
+@pytest.mark.asyncio
+async def test_writes_rows_in_batches_of_batch_size(monkeypatch):
+    monkeypatch.setattr(sms_log_writer, "LOG_BATCH_SIZE", 2)
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    assert writer.submit([log_row(f"2782000000{i}") for i in range(5)]) == []
+    await writer.stop()
+
+    assert phones(factory.batches) == [
+        ["27820000000", "27820000001"],
+        ["27820000002", "27820000003"],
+        ["27820000004"]
+    ]
+
+@pytest.mark.asyncio
+async def test_writes_partial_batch_after_flush_deadline(monkeypatch):
+    monkeypatch.setattr(sms_log_writer, "LOG_FLUSH_SECONDS", 0.01)
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    writer.submit([log_row("27820000000")])
+    await asyncio.sleep(0.1)
+
+    assert phones(factory.batches) == [["27820000000"]] # Written before stop() was called
+    await writer.stop()
+
+@pytest.mark.asyncio
+async def test_stop_flushes_queued_rows():
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    writer.submit([log_row("27820000000"), log_row("27820000001")])
+    await writer.stop()
+
+    assert phones(factory.batches) == [["27820000000", "27820000001"]]
+    # Once stopped, rows are handed back for the caller to write
+    assert writer.submit([log_row("27820000002")]) == [log_row("27820000002")]
+
+@pytest.mark.asyncio
+async def test_stop_does_not_block_on_a_full_queue():
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory, max_queue_size=2)
+    writer.start()
+
+    writer.submit([log_row("27820000000"), log_row("27820000001")])
+    await asyncio.wait_for(writer.stop(), timeout=1)
+
+    assert phones(factory.batches) == [["27820000000", "27820000001"]]
+
+@pytest.mark.asyncio
+async def test_submit_returns_rows_that_do_not_fit():
+    writer = SMSLogWriter(FakeSessionFactory(), max_queue_size=2)
+    writer.start()
+
+    rows = [log_row("27820000000"), log_row("27820000001"), log_row("27820000002")]
+    assert writer.submit(rows) == rows[2:]
+    await writer.stop()
+
+@pytest.mark.asyncio
+async def test_submit_returns_rows_when_writer_has_died():
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory)
+    writer.start()
+    writer._task.cancel()
+    await asyncio.sleep(0)
+
+    rows = [log_row("27820000000")]
+    assert writer.submit(rows) == rows
+    await writer.stop()
+    assert factory.batches == []
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_row_by_row():
+    # The student of 27820000001 was deleted before its row was written
+    factory = FakeSessionFactory(errors={"27820000001": foreign_key_error()})
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    writer.submit([
+        log_row("27820000000", student_id="student-1"),
+        log_row("27820000001", student_id="student-2"),
+        log_row("27820000002", student_id="student-3")
+    ])
+    await writer.stop()
+
+    # Every row is kept; only the dangling one is written without its student
+    assert factory.batches == [
+        [("27820000000", "student-1")],
+        [("27820000001", None)],
+        [("27820000002", "student-3")]
+    ]
+
+@pytest.mark.asyncio
+async def test_other_row_errors_keep_student_id():
+    # A transient error must not be mistaken for a deleted student
+    factory = FakeSessionFactory(errors={"27820000001": RuntimeError("canceling statement due to statement timeout")})
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    writer.submit([
+        log_row("27820000000", student_id="student-1"),
+        log_row("27820000001", student_id="student-2")
+    ])
+    await writer.stop()
+
+    # The failing row is dropped rather than unlinked from a student who still exists
+    assert factory.batches == [[("27820000000", "student-1")]]
+
+@pytest.mark.asyncio
+async def test_connection_errors_are_not_retried_row_by_row():
+    connection_error = OperationalError("INSERT INTO sms_logs", {}, FakeDriverError("connection was closed"))
+    factory = FakeSessionFactory(errors={f"2782000000{i}": connection_error for i in range(5)})
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    writer.submit([log_row(f"2782000000{i}", student_id=f"student-{i}") for i in range(5)])
+    await writer.stop()
+
+    assert factory.batches == []
+    assert factory.attempts == 1
+
+@pytest.mark.asyncio
+async def test_writer_keeps_running_after_a_failed_write(monkeypatch):
+    monkeypatch.setattr(sms_log_writer, "LOG_FLUSH_SECONDS", 0.01)
+    factory = FakeSessionFactory()
+    writer = SMSLogWriter(factory)
+    writer.start()
+
+    async def failing_write(batch):
+        raise RuntimeError("connection lost")
+    monkeypatch.setattr(writer, "_write", failing_write)
+    writer.submit([log_row("27820000000")])
+    await asyncio.sleep(0.05)
+
+    assert not writer._task.done()
+    monkeypatch.undo()
+    await writer.stop()
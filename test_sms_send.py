@@ -1,4 +1,7 @@
+import argparse
 import asyncio
+from contextlib import nullcontext
+from typing import List
 from app.config import get_settings, Settings
 from app.services.sms_service import SMSService
 from app.database import get_db
@@ -7,7 +10,34 @@ from app.utils.logger import setup_logger
 
 logger = setup_logger()
 
-async def run_test_send_sms():
+DEFAULT_TEST_NUMBER = "27669990771"  # Replace with a valid test number in 27XXXXXXXXX format
+DEFAULT_TEST_MESSAGE = "This is a test message from the WinSMS integration script."
+
+class MockScalars:
+    def all(self):
+        return []
+
+class MockResult:
+    def scalars(self):
+        return MockScalars()
+
+# Stands in for the AsyncSession SMSService logs to; see run_test_send_sms
+class MockAsyncSession:
+    _log = staticmethod(logger.info)  # Bound once rather than looked up on every call
+
+    def add(self, obj):
+        self._log(f"Mock DB: Added {obj.__class__.__name__}")
+    async def commit(self):
+        self._log("Mock DB: Committed")
+    async def rollback(self):
+        self._log("Mock DB: Rolled back")
+    async def execute(self, statement, params=None):
+        self._log(f"Mock DB: Executed statement {statement}")
+        return MockResult()
+    def begin_nested(self):
+        return nullcontext()  # Bulk sends write their log rows inside a savepoint
+
+async def run_test_send_sms(numbers: List[str], message: str):
     settings: Settings = get_settings()
     
     # Create a dummy AsyncSession for the test. 
@@ -28,48 +58,40 @@ async def run_test_send_sms():
     # For a simple script, we can create a temporary in-memory SQLite DB or mock the session.
     # Given the task is to test SMS sending, let's mock the DB session for now to avoid complex setup.
     
-    class MockAsyncSession:
-        def add(self, obj):
-            logger.info(f"Mock DB: Added {obj.__class__.__name__}")
-        async def commit(self):
-            logger.info("Mock DB: Committed")
-        async def rollback(self):
-            logger.info("Mock DB: Rolled back")
-        async def execute(self, statement):
-            logger.info(f"Mock DB: Executed statement {statement}")
-            class MockResult:
-                def scalars(self):
-                    class MockScalars:
-                        def all(self):
-                            return []
-                    return MockScalars()
-            return MockResult()
-
     mock_db = MockAsyncSession()
     
+    # One service, and so one HTTP client, for every send in this run
     sms_service = SMSService(settings, mock_db)
+    try:
+        # Test 1: Get credit balance
+        print("Testing credit balance...")
+        balance_result = await sms_service.get_credit_balance()
+        print(f"Balance result: {balance_result}")
+        assert balance_result["status"] == "success", "Failed to get credit balance"
+        print("✓ Credit balance test passed")
 
-    # Test 1: Get credit balance
-    print("Testing credit balance...")
-    balance_result = await sms_service.get_balance()
-    print(f"Balance result: {balance_result}")
-    assert balance_result["status"] == "success", "Failed to get credit balance"
-    print("✓ Credit balance test passed")
-
-    # Test 2: Send a single SMS
-    test_number = "27669990771"  # Replace with a valid test number in 27XXXXXXXXX format
-    test_message = "This is a test message from the WinSMS integration script."
-
-    print(f"\nAttempting to send SMS to: {test_number}")
-    print(f"Message: {test_message}")
-
-    send_result = await sms_service.send_sms(to=test_number, message=test_message, student_id="00000000-0000-0000-0000-000000000001")
-    print(f"SMS send result: {send_result}")
-    assert send_result["status"] == "success", "Failed to send SMS"
-    print("✓ SMS sending test passed")
+        # Test 2: Send the SMS to every number
+        print(f"\nAttempting to send SMS to: {', '.join(numbers)}")
+        print(f"Message: {message}")
 
-    await sms_service.close()
+        # One bulk send: numbers go out in batched requests, with sms_concurrency in flight at most
+        send_results = await sms_service.send_bulk_sms(numbers, message)
+        for send_result in send_results:
+            print(f"SMS send result for {send_result['to']}: {send_result}")
+            assert send_result["status"] == "success", f"Failed to send SMS to {send_result['to']}"
+        print("✓ SMS sending test passed")
+    finally:
+        await sms_service.close()
     print("\nWinSMS integration tests complete.")
 
 if __name__ == "__main__":
-    asyncio.run(run_test_send_sms())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Send test SMS messages through WinSMS.")
+    parser.add_argument("numbers", nargs="*", default=[DEFAULT_TEST_NUMBER], help="Recipient numbers")
+    parser.add_argument("--message", default=DEFAULT_TEST_MESSAGE, help="Message to send")
+    args = parser.parse_args()
+    try:
+        import uvloop  # Installed with uvicorn[standard]; not available on every platform
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(run_test_send_sms(args.numbers, args.message))
@@ -1,10 +1,26 @@
+import orjson
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from app.config import Settings
-from app.services.sms_service import SMSService
+from app.services import sms_service as sms_service_module
+from app.services.sms_service import SMSService, _status_cache
 from app.schemas.sms_log import SMSLogCreate
+import app.models.student  # Registers Student, which the SMSLog relationship refers to
 from httpx import Response, Request, HTTPStatusError, RequestError
 
+# Requests attached to the mocked responses; they are never sent, so every test shares them
+POST_REQUEST = Request("POST", "http://test.com")
+GET_REQUEST = Request("GET", "http://test.com")
+
+def json_response(status_code, request, payload):
+    """Builds a mocked JSON response, encoding the payload with orjson like the service does."""
+    return Response(
+        status_code=status_code,
+        request=request,
+        content=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"}
+    )
+
 # Fixture for settings
 @pytest.fixture
 def settings():
@@ -18,25 +34,59 @@ def settings():
         compose_project_name="test"
     )
 
+# Status lookups are cached across services, so each test starts with an empty cache
+@pytest.fixture(autouse=True)
+def clear_status_cache():
+    _status_cache.clear()
+    yield
+    _status_cache.clear()
+
+class FakeAsyncClient:
+    """
+    Minimal stand-in for httpx.AsyncClient that records only what the tests inspect.
+    Set post_return/get_return to the Response to hand back, or to an exception to raise.
+    """
+    def __init__(self):
+        self.post_calls = []
+        self.get_calls = []
+        self.post_return = None
+        self.get_return = None
+
+    async def post(self, *args, **kwargs):
+        self.post_calls.append((args, kwargs))
+        return self._result(self.post_return)
+
+    async def get(self, *args, **kwargs):
+        self.get_calls.append((args, kwargs))
+        return self._result(self.get_return)
+
+    @staticmethod
+    def _result(value):
+        if isinstance(value, Exception):
+            raise value
+        return value
+
 # Fixture for SMSService with mocked dependencies
 @pytest.fixture
 def sms_service(settings):
     mock_db_session = AsyncMock()
+    mock_db_session.add = MagicMock() # AsyncSession.add is synchronous
+    mock_db_session.begin_nested = MagicMock() # Used as an async context manager, not awaited
     service = SMSService(settings=settings, db=mock_db_session)
-    service.client = AsyncMock() # Mock the httpx.AsyncClient
+    service.client = FakeAsyncClient() # Stand in for the httpx.AsyncClient
     return service
 
 @pytest.mark.asyncio
 async def test_send_sms_success(sms_service):
     # Mock successful API response
-    sms_service.client.post.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=200,
-        request=Request("POST", "http://test.com"),
-        json={
+        request=POST_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
-            "messages": [
+            "recipients": [
                 {
                     "apiMessageId": 12345678,
                     "acceptedTime": "2024-01-01 12:00:00",
@@ -56,7 +106,7 @@ async def test_send_sms_success(sms_service):
 
     assert result["status"] == "success"
     assert result["message_id"] == "12345678"
-    sms_service.client.post.assert_called_once()
+    assert len(sms_service.client.post_calls) == 1
     sms_service.db.add.assert_called_once()
     logged_sms = sms_service.db.add.call_args[0][0]
     assert logged_sms.recipient_phone == to
@@ -66,14 +116,14 @@ async def test_send_sms_success(sms_service):
 
 @pytest.mark.asyncio
 async def test_send_sms_invalid_phone(sms_service):
-    to = "invalid-phone"
+    to = "1234567890" # Fits the recipient_phone column, so the failure is still logged
     message = "Test message"
     student_id = "test-student-123"
     result = await sms_service.send_sms(to=to, message=message, student_id=student_id)
 
     assert result["status"] == "failed"
     assert "Invalid phone number" in result["detail"]
-    sms_service.client.post.assert_not_called()
+    assert not sms_service.client.post_calls
     sms_service.db.add.assert_called_once()
     logged_sms = sms_service.db.add.call_args[0][0]
     assert logged_sms.status == "failed"
@@ -82,10 +132,10 @@ async def test_send_sms_invalid_phone(sms_service):
 @pytest.mark.asyncio
 async def test_send_sms_api_error(sms_service):
     # Mock API error response
-    sms_service.client.post.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=401,
-        request=Request("POST", "http://test.com"),
-        json={"errorMessage": "Unauthorized"}
+        request=POST_REQUEST,
+        payload={"errorMessage": "Unauthorized"}
     )
 
     to = "27821234567"
@@ -95,7 +145,7 @@ async def test_send_sms_api_error(sms_service):
 
     assert result["status"] == "failed"
     assert "Unauthorized" in result["detail"]
-    sms_service.client.post.assert_called_once()
+    assert len(sms_service.client.post_calls) == 1
     sms_service.db.add.assert_called_once()
     logged_sms = sms_service.db.add.call_args[0][0]
     assert logged_sms.status == "failed"
@@ -103,7 +153,7 @@ async def test_send_sms_api_error(sms_service):
 
 @pytest.mark.asyncio
 async def test_send_sms_network_error(sms_service):
-    sms_service.client.post.side_effect = RequestError("Network issue", request=Request("POST", "http://test.com"))
+    sms_service.client.post_return = RequestError("Network issue", request=POST_REQUEST)
 
     to = "27821234567"
     message = "Test message"
@@ -112,7 +162,7 @@ async def test_send_sms_network_error(sms_service):
 
     assert result["status"] == "failed"
     assert "Network error" in result["detail"]
-    sms_service.client.post.assert_called_once()
+    assert len(sms_service.client.post_calls) == 1
     sms_service.db.add.assert_called_once()
     logged_sms = sms_service.db.add.call_args[0][0]
     assert logged_sms.status == "failed"
@@ -120,10 +170,10 @@ async def test_send_sms_network_error(sms_service):
 
 @pytest.mark.asyncio
 async def test_get_credit_balance_success(sms_service):
-    sms_service.client.get.return_value = Response(
+    sms_service.client.get_return = json_response(
         status_code=200,
-        request=Request("GET", "http://test.com"),
-        json={
+        request=GET_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
@@ -135,32 +185,38 @@ async def test_get_credit_balance_success(sms_service):
 
     assert result["status"] == "success"
     assert result["credit_balance"] == 150.5
-    sms_service.client.get.assert_called_once()
+    assert len(sms_service.client.get_calls) == 1
 
 @pytest.mark.asyncio
-async def test_get_credit_balance_failure(sms_service):
-    sms_service.client.get.return_value = Response(
-        status_code=500,
-        request=Request("GET", "http://test.com"),
-        json={"errorMessage": "Internal Server Error"}
-    )
-
-    result = await sms_service.get_credit_balance()
+@pytest.mark.parametrize("method, args, http_method, status_code, error_message", [
+    ("get_credit_balance", (), "get", 500, "Internal Server Error"),
+    ("get_message_status", (99999999,), "post", 404, "Message not found"),
+    ("get_multiple_message_statuses", ([1, 2],), "post", 500, "Internal Server Error"),
+    ("get_incoming_sms_messages", (), "get", 401, "Unauthorized"),
+])
+async def test_api_call_failure(sms_service, method, args, http_method, status_code, error_message):
+    setattr(sms_service.client, f"{http_method}_return", json_response(
+        status_code=status_code,
+        request=POST_REQUEST if http_method == "post" else GET_REQUEST,
+        payload={"errorMessage": error_message}
+    ))
+
+    result = await getattr(sms_service, method)(*args)
 
     assert result["status"] == "failed"
-    assert "Internal Server Error" in result["detail"]
-    sms_service.client.get.assert_called_once()
+    assert error_message in result["detail"]
+    assert len(getattr(sms_service.client, f"{http_method}_calls")) == 1
 
 @pytest.mark.asyncio
 async def test_send_bulk_sms_success(sms_service):
-    sms_service.client.post.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=200,
-        request=Request("POST", "http://test.com"),
-        json={
+        request=POST_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
-            "messages": [
+            "recipients": [
                 {"apiMessageId": 1, "mobileNumber": "27821234567"},
                 {"apiMessageId": 2, "mobileNumber": "27827654321"}
             ]
@@ -175,69 +231,77 @@ async def test_send_bulk_sms_success(sms_service):
     assert all(r["status"] == "success" for r in results)
     assert results[0]["message_id"] == "1"
     assert results[1]["message_id"] == "2"
-    sms_service.client.post.assert_called_once()
-    assert sms_service.db.add.call_count == 2
-    
-    logged_sms_1 = sms_service.db.add.call_args_list[0][0][0]
-    assert logged_sms_1.recipient_phone == "27821234567"
-    assert logged_sms_1.api_message_id == "1"
+    assert len(sms_service.client.post_calls) == 1
+    # Bulk log rows are written with a single multi-row INSERT
+    sms_service.db.add.assert_not_called()
+    sms_service.db.execute.assert_called_once()
+    logged_rows = sms_service.db.execute.call_args[0][1]
+    assert len(logged_rows) == 2
+
+    assert logged_rows[0]["recipient_phone"] == "27821234567"
+    assert logged_rows[0]["api_message_id"] == "1"
 
-    logged_sms_2 = sms_service.db.add.call_args_list[1][0][0]
-    assert logged_sms_2.recipient_phone == "27827654321"
-    assert logged_sms_2.api_message_id == "2"
+    assert logged_rows[1]["recipient_phone"] == "27827654321"
+    assert logged_rows[1]["api_message_id"] == "2"
 
 @pytest.mark.asyncio
 async def test_send_bulk_sms_partial_failure_invalid_phone(sms_service):
-    sms_service.client.post.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=200,
-        request=Request("POST", "http://test.com"),
-        json={
+        request=POST_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
-            "messages": [
+            "recipients": [
                 {"apiMessageId": 1, "mobileNumber": "27821234567"}
             ]
         }
     )
 
-    recipients = ["27821234567", "invalid-phone"]
+    invalid_phone = "1234567890" # Fits the recipient_phone column, so the failure is still logged
+    recipients = ["27821234567", invalid_phone]
     message = "Bulk test message"
     results = await sms_service.send_bulk_sms(recipients=recipients, message=message)
 
+    # Invalid recipients are reported first, followed by the sent ones
     assert len(results) == 2
-    assert results[0]["status"] == "success"
-    assert results[0]["message_id"] == "1"
-    assert results[1]["status"] == "failed"
-    assert "Invalid phone number" in results[1]["detail"]
-    
-    sms_service.client.post.assert_called_once() # Only called for the valid number
-    assert sms_service.db.add.call_count == 2
+    assert results[0]["to"] == invalid_phone
+    assert results[0]["status"] == "failed"
+    assert "Invalid phone number" in results[0]["detail"]
+    assert results[1]["status"] == "success"
+    assert results[1]["message_id"] == "1"
 
-    logged_sms_1 = sms_service.db.add.call_args_list[0][0][0]
-    assert logged_sms_1.recipient_phone == "27821234567"
-    assert logged_sms_1.status == "success"
-    assert logged_sms_1.api_message_id == "1"
+    assert len(sms_service.client.post_calls) == 1 # Only called for the valid number
+    sms_service.db.execute.assert_called_once()
+    logged_rows = sms_service.db.execute.call_args[0][1]
+    assert len(logged_rows) == 2
 
-    logged_sms_2 = sms_service.db.add.call_args_list[1][0][0]
-    assert logged_sms_2.recipient_phone == "invalid-phone"
-    assert logged_sms_2.status == "failed"
-    assert "Invalid phone number" in logged_sms_2.error_detail
+    assert logged_rows[0]["recipient_phone"] == invalid_phone
+    assert logged_rows[0]["status"] == "failed"
+    assert "Invalid phone number" in logged_rows[0]["error_detail"]
+
+    assert logged_rows[1]["recipient_phone"] == "27821234567"
+    assert logged_rows[1]["status"] == "success"
+    assert logged_rows[1]["api_message_id"] == "1"
 
 @pytest.mark.asyncio
 async def test_get_message_status_success(sms_service):
-    sms_service.client.get.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=200,
-        request=Request("GET", "http://test.com"),
-        json={
+        request=POST_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
-            "apiMessageId": 12345678,
-            "mobileNumber": "27821234567",
-            "statusCode": 10,
-            "statusDescription": "Delivered",
-            "creditCost": 1.0
+            "messages": [
+                {
+                    "apiMessageId": 12345678,
+                    "mobileNumber": "27821234567",
+                    "statusDescription": "Delivered",
+                    "creditCost": 1.0
+                }
+            ]
         }
     )
 
@@ -245,34 +309,19 @@ async def test_get_message_status_success(sms_service):
     result = await sms_service.get_message_status(api_message_id=api_message_id)
 
     assert result["status"] == "success"
-    assert result["detail"]["statusDescription"] == "Delivered"
-    sms_service.client.get.assert_called_once_with(
-        f"{sms_service.base_url}/sms/outbound/status/{api_message_id}",
-        headers=sms_service.headers,
-        timeout=30
-    )
-
-@pytest.mark.asyncio
-async def test_get_message_status_failure(sms_service):
-    sms_service.client.get.return_value = Response(
-        status_code=404,
-        request=Request("GET", "http://test.com"),
-        json={"errorMessage": "Message not found"}
-    )
-
-    api_message_id = 99999999
-    result = await sms_service.get_message_status(api_message_id=api_message_id)
-
-    assert result["status"] == "failed"
-    assert "Message not found" in result["detail"]
-    sms_service.client.get.assert_called_once()
+    assert result["detail"]["messages"][0]["statusDescription"] == "Delivered"
+    # Single lookups go through the multiple status endpoint
+    assert sms_service.client.post_calls == [(
+        ("/sms/outgoing/status",),
+        {"content": orjson.dumps({"apiMessageIds": [api_message_id]})}
+    )]
 
 @pytest.mark.asyncio
 async def test_get_multiple_message_statuses_success(sms_service):
-    sms_service.client.post.return_value = Response(
+    sms_service.client.post_return = json_response(
         status_code=200,
-        request=Request("POST", "http://test.com"),
-        json={
+        request=POST_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
@@ -288,34 +337,94 @@ async def test_get_multiple_message_statuses_success(sms_service):
 
     assert result["status"] == "success"
     assert len(result["detail"]["messages"]) == 2
-    sms_service.client.post.assert_called_once_with(
-        f"{sms_service.base_url}/sms/outbound/status",
-        json={"apiMessageIds": api_message_ids},
-        headers=sms_service.headers,
-        timeout=30
+    assert sms_service.client.post_calls == [(
+        ("/sms/outgoing/status",),
+        {"content": orjson.dumps({"apiMessageIds": api_message_ids})}
+    )]
+
+@pytest.mark.asyncio
+async def test_get_multiple_message_statuses_merges_cached_in_input_order(sms_service):
+    # The API may echo IDs back as strings; the cache treats 2 and "2" as the same message
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={"statusCode": 200, "messages": [{"apiMessageId": "2", "statusDescription": "Delivered"}]}
+    )
+    await sms_service.get_multiple_message_statuses(api_message_ids=[2])
+
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={"statusCode": 200, "messages": [
+            {"apiMessageId": 1, "statusDescription": "Sent"},
+            {"apiMessageId": 3, "statusDescription": "Sent"}
+        ]}
+    )
+    result = await sms_service.get_multiple_message_statuses(api_message_ids=[1, 2, 3])
+
+    assert result["status"] == "success"
+    assert [m["apiMessageId"] for m in result["detail"]["messages"]] == [1, "2", 3]
+    # Only the uncached IDs are requested
+    assert sms_service.client.post_calls[1] == (
+        ("/sms/outgoing/status",),
+        {"content": orjson.dumps({"apiMessageIds": [1, 3]})}
     )
 
 @pytest.mark.asyncio
-async def test_get_multiple_message_statuses_failure(sms_service):
-    sms_service.client.post.return_value = Response(
-        status_code=500,
-        request=Request("POST", "http://test.com"),
-        json={"errorMessage": "Internal Server Error"}
+async def test_status_cache_evicts_least_recently_used(sms_service, monkeypatch):
+    monkeypatch.setattr(sms_service_module, "STATUS_CACHE_MAX_SIZE", 2)
+    for api_message_id in (1, 2, 3):
+        sms_service.client.post_return = json_response(
+            status_code=200,
+            request=POST_REQUEST,
+            payload={"statusCode": 200, "messages": [{"apiMessageId": api_message_id, "statusDescription": "Sent"}]}
+        )
+        await sms_service.get_multiple_message_statuses(api_message_ids=[api_message_id])
+
+    assert list(_status_cache) == ["2", "3"]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ids", [[1], [1, 2], [1, 2, 3, 4, 5, 10]])
+async def test_get_multiple_message_statuses_batches_ids(sms_service, ids):
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={
+            "statusCode": 200,
+            "messages": [{"apiMessageId": i, "statusDescription": "Delivered"} for i in ids]
+        }
     )
 
-    api_message_ids = [1, 2]
-    result = await sms_service.get_multiple_message_statuses(api_message_ids=api_message_ids)
+    result = await sms_service.get_multiple_message_statuses(api_message_ids=ids)
 
-    assert result["status"] == "failed"
-    assert "Internal Server Error" in result["detail"]
-    sms_service.client.post.assert_called_once()
+    assert result["status"] == "success"
+    assert [m["apiMessageId"] for m in result["detail"]["messages"]] == ids
+    assert len(sms_service.client.post_calls) == 1 # One request however many IDs are polled
+
+@pytest.mark.asyncio
+async def test_get_multiple_message_statuses_uses_cache(sms_service):
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={
+            "statusCode": 200,
+            "messages": [{"apiMessageId": 1, "statusDescription": "Delivered"}]
+        }
+    )
+
+    await sms_service.get_multiple_message_statuses(api_message_ids=[1])
+    result = await sms_service.get_multiple_message_statuses(api_message_ids=[1])
+
+    assert result["status"] == "success"
+    assert result["detail"]["messages"] == [{"apiMessageId": 1, "statusDescription": "Delivered"}]
+    assert len(sms_service.client.post_calls) == 1 # The repeat poll is served from the cache
 
 @pytest.mark.asyncio
 async def test_get_incoming_sms_messages_success(sms_service):
-    sms_service.client.get.return_value = Response(
+    sms_service.client.get_return = json_response(
         status_code=200,
-        request=Request("GET", "http://test.com"),
-        json={
+        request=GET_REQUEST,
+        payload={
             "timeStamp": "20240101120000000",
             "version": "1.0",
             "statusCode": 200,
@@ -329,22 +438,59 @@ async def test_get_incoming_sms_messages_success(sms_service):
 
     assert result["status"] == "success"
     assert len(result["detail"]["incomingMessages"]) == 1
-    sms_service.client.get.assert_called_once_with(
-        f"{sms_service.base_url}/sms/inbound",
-        headers=sms_service.headers,
-        timeout=30
+    assert sms_service.client.get_calls == [(("/sms/incoming",), {})]
+
+@pytest.mark.asyncio
+async def test_send_bulk_personalized_groups_by_message(sms_service):
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={
+            "statusCode": 200,
+            "recipients": [
+                {"apiMessageId": 1, "mobileNumber": "27821234567"},
+                {"apiMessageId": 2, "mobileNumber": "27827654321"}
+            ]
+        }
     )
 
+    messages = [
+        {"to": "27821234567", "message": "Same message", "student_id": "student-1"},
+        {"to": "invalid-phone", "message": "Same message", "student_id": "student-2"},
+        {"to": "0827654321", "message": "Same message", "student_id": "student-3"}
+    ]
+    results = await sms_service.send_bulk_personalized(messages)
+
+    assert len(results) == 3
+    assert results[0]["status"] == "success"
+    assert results[0]["message_id"] == "1"
+    assert results[1]["status"] == "failed"
+    assert "Invalid phone number" in results[1]["detail"]
+    assert results[2]["status"] == "success"
+    assert results[2]["to"] == "27827654321"
+    assert results[2]["student_id"] == "student-3"
+    # Both valid recipients share a message body, so only one request is made
+    assert len(sms_service.client.post_calls) == 1
+
 @pytest.mark.asyncio
-async def test_get_incoming_sms_messages_failure(sms_service):
-    sms_service.client.get.return_value = Response(
-        status_code=401,
-        request=Request("GET", "http://test.com"),
-        json={"errorMessage": "Unauthorized"}
+async def test_send_bulk_sms_splits_recipients_into_batches(sms_service):
+    sms_service.settings.sms_batch_size = 1
+    sms_service.client.post_return = json_response(
+        status_code=200,
+        request=POST_REQUEST,
+        payload={
+            "statusCode": 200,
+            "recipients": [
+                {"apiMessageId": 1, "mobileNumber": "27821234567"},
+                {"apiMessageId": 2, "mobileNumber": "27827654321"}
+            ]
+        }
     )
 
-    result = await sms_service.get_incoming_sms_messages()
+    # The duplicate (in another format) is only sent once
+    recipients = ["27821234567", "0821234567", "27827654321"]
+    results = await sms_service.send_bulk_sms(recipients=recipients, message="Bulk test message")
 
-    assert result["status"] == "failed"
-    assert "Unauthorized" in result["detail"]
-    sms_service.client.get.assert_called_once()
+    assert [r["to"] for r in results] == ["27821234567", "27827654321"]
+    assert all(r["status"] == "success" for r in results)
+    assert len(sms_service.client.post_calls) == 2